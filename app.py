@@ -3,21 +3,30 @@ Lecture Notes -> Handwritten Notes
 ------------------------------------
 Run: python app.py
 Then open http://localhost:5000
-Requires: pip install flask openai PyMuPDF Pillow
+Requires: pip install flask openai PyMuPDF Pillow  (optional: brotli)
 Put Caveat-VariableFont_wght.ttf in the same folder.
 """
 
-import os, random, math, io, base64, traceback, secrets
-from flask import Flask, request, jsonify, render_template_string, session
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import fitz  # PyMuPDF
-from openai import OpenAI
-from pptx import Presentation
+import os, re, random, tempfile, math, io, base64, traceback, secrets, hashlib, sqlite3, threading, time
+_BOOT_T0 = time.perf_counter()
+import gzip, importlib, json, mmap, queue, struct
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+import multiprocessing, posixpath, zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from flask import Flask, Request, Response, request, jsonify, session, has_request_context, g, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
+# fitz (PyMuPDF) and openai are imported on first use, see lazy_import()
+_IMPORTS_DONE = time.perf_counter()
 
 # ── CONFIG ────────────────────────────────────────────────────────────────────
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR_API_KEY_HERE")
-FONT_PATH      = "Biro_Script_reduced.ttf"
-FONT_FALLBACK  = "Caveat-VariableFont_wght.ttf"
+APP_DIR        = os.path.dirname(os.path.abspath(__file__))
+FONT_PATH      = os.path.join(APP_DIR, "Biro_Script_reduced.ttf")
+FONT_FALLBACK  = os.path.join(APP_DIR, "Caveat-VariableFont_wght.ttf")
 
 PAGE_W, PAGE_H      = 2550, 3300   # 300dpi letter (8.5x11in)
 MARGIN_LEFT         = 380          # left red margin line x
@@ -38,38 +47,306 @@ SIZE_VARIATION      = 0.02
 SPACING_VARIATION   = 0.04
 INK_VARIATION       = 22
 WORD_SPACING_JITTER = 6
+RENDER_MODE         = os.environ.get("RENDER_MODE", "glyph")            # glyph | word | warp | draft | auto
+AUTO_WORD_MESSINESS = float(os.environ.get("AUTO_WORD_MESSINESS", 0.4))  # "auto" draws words at or below this
+WORD_TILT_SCALE     = 0.2    # a word tilts this fraction of the per-char rotation range
+WARP_WAVELENGTH     = 900    # px; warp mode's wobble wavelength at messiness 0 (shorter when messier)
+WARP_CELL           = 32     # px width of each warp mesh column
+LAYOUT_HEAD_START   = 0.25   # s the first page waits for layout to finish, so its progress has a total
+DRAFT_SCALE         = float(os.environ.get("DRAFT_SCALE", 0.5))  # draft pages are drawn at this fraction of 300dpi
+
+LLM_BACKEND          = os.environ.get("LLM_BACKEND", "openai")          # openai | fake
+FAKE_LLM_PROFILE     = os.environ.get("FAKE_LLM_PROFILE", "gpt-4o-mini")  # see FAKE_LLM_PROFILES
+NOTES_MODEL          = "gpt-4o-mini"
+VISION_MODEL         = "gpt-4o"
+VISION_MAX_EDGE      = int(os.environ.get("VISION_MAX_EDGE", 1600))    # px, long edge sent to vision
+VISION_JPEG_QUALITY  = int(os.environ.get("VISION_JPEG_QUALITY", 82))
+NOTES_PROMPT_VERSION = "3"          # bump whenever the notes prompt changes
+NOTES_CHUNK_TOKENS   = int(os.environ.get("NOTES_CHUNK_TOKENS", 4000))  # longer input is split into chunks
+NOTES_TOKEN_BUDGET   = int(os.environ.get("NOTES_TOKEN_BUDGET", 64000)) # lecture text beyond this is cut
+NOTES_CONCURRENCY    = int(os.environ.get("NOTES_CONCURRENCY", 4))     # parallel LLM calls per request
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 40))  # smaller PDFs are read in-process
+PDF_PAGES_PER_TASK   = int(os.environ.get("PDF_PAGES_PER_TASK", 16))
+PDF_WORKERS          = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+OCR_DPI              = int(os.environ.get("OCR_DPI", 110))            # rasterization for image-only pages
+OCR_CONCURRENCY      = int(os.environ.get("OCR_CONCURRENCY", 4))       # parallel vision calls per PDF
+OCR_MAX_PAGES        = int(os.environ.get("OCR_MAX_PAGES", 60))        # distinct pages sent to vision
+MAX_UPLOAD_MB        = int(os.environ.get("MAX_UPLOAD_MB", 50))        # per file; also the body cap (x BATCH_MAX_FILES for a batch)
+UPLOAD_SPOOL_MB      = int(os.environ.get("UPLOAD_SPOOL_MB", 2))       # bigger request bodies go to a temp file
+BATCH_MAX_FILES      = int(os.environ.get("BATCH_MAX_FILES", 20))
+BATCH_CONCURRENCY    = int(os.environ.get("BATCH_CONCURRENCY", 3))     # files processed at once
+JOB_MEMORY_BUDGET_MB = int(os.environ.get("JOB_MEMORY_BUDGET_MB", 1024))  # RSS growth per job, 0 = no limit
+MEMORY_SAMPLE_MS     = int(os.environ.get("MEMORY_SAMPLE_MS", 25))
+DISCONNECT_GRACE_S   = float(os.environ.get("DISCONNECT_GRACE_S", 5))  # no /progress stream this long = client gone
+CACHE_DIR            = os.environ.get("CACHE_DIR", os.path.join(APP_DIR, "cache"))
+NOTES_CACHE_PATH     = os.environ.get("NOTES_CACHE_PATH", os.path.join(CACHE_DIR, "notes.sqlite3"))
+NOTES_CACHE_ENTRIES  = int(os.environ.get("NOTES_CACHE_ENTRIES", 128))        # in-memory LRU size
+NOTES_CACHE_MAX_MB   = int(os.environ.get("NOTES_CACHE_MAX_MB", 256))         # on-disk size cap
+CACHE_MAX_AGE        = int(os.environ.get("CACHE_MAX_AGE", 30 * 86400))       # seconds, both caches
+EXTRACTOR_VERSION    = "5"          # bump whenever extraction output changes
+EXTRACT_CACHE_PATH   = os.environ.get("EXTRACT_CACHE_PATH", os.path.join(CACHE_DIR, "extract.sqlite3"))  # "" = memory only
+EXTRACT_CACHE_ITEMS  = int(os.environ.get("EXTRACT_CACHE_ITEMS", 64))
+EXTRACT_CACHE_MAX_MB = int(os.environ.get("EXTRACT_CACHE_MAX_MB", 128))
+WARM_UP              = os.environ.get("WARM_UP", "1") != "0"        # preload fonts/glyphs at boot
+GLYPH_CACHE_ITEMS    = int(os.environ.get("GLYPH_CACHE_ITEMS", 20000))  # rasterized (char, size) masks
+GLYPH_ATLAS_DIR      = os.environ.get("GLYPH_ATLAS_DIR", os.path.join(CACHE_DIR, "glyph_atlas"))  # "" = off
+
+
+# ── STARTUP ───────────────────────────────────────────────────────────────────
+
+STARTUP_TIMES = OrderedDict(imports=_IMPORTS_DONE - _BOOT_T0)   # phase -> seconds
+_lazy_modules = {}
+
+def lazy_import(name):
+    """
+    Import a heavy module the first time it is needed. openai (~1 s) and
+    PyMuPDF (~0.2 s) are only used for some uploads, so a cold start (and
+    every PDF pool worker) skips them until then.
+    """
+    module = _lazy_modules.get(name)
+    if module is None:
+        t0     = time.perf_counter()
+        module = importlib.import_module(name)
+        _lazy_modules[name] = module
+        STARTUP_TIMES[f"lazy {name}"] = time.perf_counter() - t0
+        metrics.set("handywrite_startup_seconds", STARTUP_TIMES[f"lazy {name}"], phase=f"lazy {name}")
+        print(f"[Startup] imported {name} on first use in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    return module
 
 
 # ── FONT HELPERS ──────────────────────────────────────────────────────────────
 
-# Characters known to be missing or broken in Biro Script — always use Caveat
-# Includes: punctuation, operators, brackets, numbers, Greek letters, math symbols
-BIRO_MISSING = set(
-    "()-+=/\\[]{}|^~`@#$%&*<>0123456789gf"
-    "αβγδεζηθικλμνξοπρστυφχψω"  # Greek lowercase
-    "ΑΒΓΔΕΖΗΘΙΚΛΜΝΞΟΠΡΣΤΥΦΧΨΩ"  # Greek uppercase
-    "±×÷≈≠≤≥∞∑∏∫∂√∆°′″"        # Math symbols
-    "¢£¥€¤"                     # Currency symbols
-    "©®™"                       # Special symbols
-    "¡¿"                        # Inverted punctuation
-    "«»‹›""''"                  # Quotation marks
-    "–—"                        # Dashes
-    "†‡§¶"                      # Reference marks
-    "•·‣⁃"                      # Bullets
-)
+# Characters Biro Script has glyphs for but draws badly — always use Caveat.
+# Anything missing from Biro's cmap goes to Caveat automatically (font_coverage).
+BIRO_BROKEN = set("fg")
+
+_font_cache     = {}   # (path, size) -> ImageFont, or None if it failed to load
+_glyph_cache    = {}   # (char, size) -> (mask, bbox)
+_coverage       = {}   # font path -> frozenset of code points, or None if unreadable
+_fallback_chars = {}   # char -> drawn with Caveat?
+
+def _cmap_codepoints(data):
+    """Code points mapped to a non-zero glyph by a TrueType/OpenType cmap (format 12 or 4)."""
+    num_tables = struct.unpack_from(">H", data, 4)[0]
+    cmap = next((offset for tag, _, offset, _ in
+                 (struct.unpack_from(">4sIII", data, 12 + 16 * i) for i in range(num_tables))
+                 if tag == b"cmap"), None)
+    if cmap is None:
+        raise ValueError("font has no cmap table")
+    subtables = {}
+    for i in range(struct.unpack_from(">H", data, cmap + 2)[0]):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+        fmt = struct.unpack_from(">H", data, cmap + offset)[0]
+        if platform in (0, 3):       # Unicode / Windows
+            subtables.setdefault(fmt, cmap + offset)
+    points = set()
+    if 12 in subtables:
+        base    = subtables[12]
+        ngroups = struct.unpack_from(">I", data, base + 12)[0]
+        for g in range(ngroups):
+            start, end, gid = struct.unpack_from(">III", data, base + 16 + 12 * g)
+            points.update(range(start + (gid == 0), end + 1))
+    elif 4 in subtables:
+        base  = subtables[4]
+        segs  = struct.unpack_from(">H", data, base + 6)[0] // 2
+        ends  = struct.unpack_from(f">{segs}H", data, base + 14)
+        starts_at = base + 16 + 2 * segs
+        starts = struct.unpack_from(f">{segs}H", data, starts_at)
+        deltas = struct.unpack_from(f">{segs}h", data, starts_at + 2 * segs)
+        ranges_at = starts_at + 4 * segs
+        ranges = struct.unpack_from(f">{segs}H", data, ranges_at)
+        for i in range(segs):
+            for c in range(starts[i], ends[i] + 1):
+                if c == 0xFFFF:
+                    continue
+                if ranges[i] == 0:
+                    gid = (c + deltas[i]) & 0xFFFF
+                else:
+                    addr = ranges_at + 2 * i + ranges[i] + 2 * (c - starts[i])
+                    gid  = struct.unpack_from(">H", data, addr)[0]
+                    gid  = (gid + deltas[i]) & 0xFFFF if gid else 0
+                if gid:
+                    points.add(c)
+    else:
+        raise ValueError("no Unicode cmap subtable in format 4 or 12")
+    return frozenset(points)
+
+def font_coverage(path):
+    """Code points `path` has real glyphs for, read from its cmap once per file."""
+    if path not in _coverage:
+        try:
+            with open(path, "rb") as f:
+                _coverage[path] = _cmap_codepoints(f.read())
+        except (OSError, ValueError, struct.error) as e:
+            print(f"[Fonts] cannot read cmap of {os.path.basename(path)}: {e}")
+            _coverage[path] = None
+    return _coverage[path]
+
+def uses_fallback(char):
+    """True if `char` is drawn with Caveat: Biro Script lacks it or draws it badly."""
+    fallback = _fallback_chars.get(char)
+    if fallback is None:
+        covered  = font_coverage(FONT_PATH)
+        fallback = char in BIRO_BROKEN or (covered is not None and ord(char) not in covered)
+        _fallback_chars[char] = fallback
+    return fallback
+
+def font_runs(text):
+    """
+    Split `text` into (run, use_fallback) pieces of consecutive characters
+    drawn with the same font. Spaces join the run they follow.
+    """
+    runs = []
+    for char in text:
+        fallback = runs[-1][1] if char == " " and runs else uses_fallback(char)
+        if runs and runs[-1][1] == fallback:
+            runs[-1][0].append(char)
+        else:
+            runs.append(([char], fallback))
+    return [("".join(chars), fallback) for chars, fallback in runs]
+
+def load_font(path, size):
+    """ImageFont.truetype, read from disk once per (path, size). None if the font can't be loaded."""
+    key = (path, size)
+    if key not in _font_cache:
+        try:
+            _font_cache[key] = ImageFont.truetype(path, size)
+        except Exception:
+            _font_cache[key] = None
+    return _font_cache[key]
+
+def font_for(use_fallback, size):
+    """The ImageFont for one font run at this size."""
+    font = load_font(FONT_FALLBACK if use_fallback else FONT_PATH, size)
+    if font is not None:
+        return font, use_fallback
+    # Try the other font before giving up
+    font = load_font(FONT_FALLBACK if not use_fallback else FONT_PATH, size)
+    if font is not None:
+        return font, True
+    return ImageFont.load_default(), True
 
 def _pick_font(char, base_size, force_fallback=False):
     """Return the best ImageFont for this character at this size."""
-    use_fallback = force_fallback or (char in BIRO_MISSING)
-    path = FONT_FALLBACK if use_fallback else FONT_PATH
+    return font_for(force_fallback or uses_fallback(char), base_size)
+
+def _rasterize_glyph(char, size, fallback=None):
+    font, _ = font_for(uses_fallback(char) if fallback is None else fallback, size)
+    bbox    = font.getbbox(char)
+    mask    = Image.new("L", (max(1, bbox[2] - bbox[0]), max(4, bbox[3] - bbox[1])), 0)
+    ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), char, font=font, fill=255)
+    return mask, bbox
+
+def glyph(char, size, fallback=None):
+    """
+    (mask, bbox) for one character: its L-mode coverage mask cropped to the
+    ink box, rasterized once per (char, size) and reused on every page.
+    Sizes with a glyph atlas on disk read the mask straight from the mmap.
+    `fallback` is the font choice from font_runs(), when the caller has it.
+    """
+    key   = (char, size)
+    entry = _glyph_cache.get(key)
+    if entry is None:
+        atlas = _atlases[size] if size in _atlases else glyph_atlas(size)
+        entry = atlas.get(char) if atlas else None
+        if entry is None:
+            entry = _rasterize_glyph(char, size, fallback)
+            if len(_glyph_cache) >= GLYPH_CACHE_ITEMS:
+                _glyph_cache.clear()
+            _glyph_cache[key] = entry
+    return entry
+
+
+# ── GLYPH ATLAS ───────────────────────────────────────────────────────────────
+#
+# One file per (fonts, size): magic, u32 index length, JSON index
+# {char: [offset, w, h, x0, y0, x1, y1]}, then every mask back to back.
+# Worker processes mmap it read-only, so the OS shares the pages between
+# them and a fresh worker starts with every common glyph already rasterized.
+
+ATLAS_MAGIC   = b"HWATLAS1"
+_atlases      = {}   # size -> {char: (mask, bbox)}, or None if there is no atlas file
+_atlas_maps   = []   # open mmaps; the masks point into them
+_atlas_digest = None
+
+def _atlas_key():
+    """Hash of everything the masks depend on: both font files, the override set and Pillow."""
+    global _atlas_digest
+    if _atlas_digest is None:
+        h = hashlib.sha256(ATLAS_MAGIC)
+        for path in (FONT_PATH, FONT_FALLBACK):
+            with open(path, "rb") as f:
+                h.update(f.read())
+        h.update("".join(sorted(BIRO_BROKEN)).encode("utf-8"))
+        h.update(Image.__version__.encode())
+        _atlas_digest = h.hexdigest()[:16]
+    return _atlas_digest
+
+def _atlas_path(size):
+    return os.path.join(GLYPH_ATLAS_DIR, f"{_atlas_key()}-{size}.atlas")
+
+def build_glyph_atlas(size, chars):
+    """Rasterize `chars` at `size` and write the atlas file atomically (temp file + rename)."""
+    index, blobs, offset = {}, [], 0
+    for char in chars:
+        mask, bbox  = _rasterize_glyph(char, size)
+        index[char] = [offset, mask.width, mask.height, *bbox]
+        blobs.append(mask.tobytes())
+        offset += len(blobs[-1])
+    header = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    path   = _atlas_path(size)
+    os.makedirs(GLYPH_ATLAS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=GLYPH_ATLAS_DIR, suffix=".tmp")
     try:
-        return ImageFont.truetype(path, base_size), use_fallback
-    except Exception:
-        # Try the other font before giving up
+        with os.fdopen(fd, "wb") as f:
+            f.write(ATLAS_MAGIC + struct.pack("<I", len(header)) + header)
+            for blob in blobs:
+                f.write(blob)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+def _map_atlas(path):
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(ATLAS_MAGIC)] != ATLAS_MAGIC:
+        mm.close()
+        raise ValueError(f"{path} is not a glyph atlas")
+    start     = len(ATLAS_MAGIC) + 4
+    (hlen,)   = struct.unpack_from("<I", mm, len(ATLAS_MAGIC))
+    index     = json.loads(mm[start:start + hlen].decode("utf-8"))
+    data      = memoryview(mm)[start + hlen:]
+    glyphs    = {}
+    for char, (offset, w, h, *bbox) in index.items():
+        # frombuffer over the memoryview: no copy, the mask reads the mapped page
+        mask = Image.frombuffer("L", (w, h), data[offset:offset + w * h], "raw", "L", 0, 1)
+        glyphs[char] = (mask, tuple(bbox))
+    _atlas_maps.append(mm)
+    return glyphs
+
+def glyph_atlas(size, build_chars=None):
+    """
+    Map the atlas for `size` if it exists; with `build_chars`, write it first
+    when it's missing. Returns {char: (mask, bbox)} or None.
+    """
+    if size in _atlases and (_atlases[size] is not None or not build_chars):
+        return _atlases[size]
+    atlas = None
+    if GLYPH_ATLAS_DIR:
         try:
-            return ImageFont.truetype(FONT_FALLBACK if not use_fallback else FONT_PATH, base_size), True
-        except Exception:
-            return ImageFont.load_default(), True
+            path = _atlas_path(size)
+            if not os.path.exists(path) and build_chars:
+                build_glyph_atlas(size, build_chars)
+                print(f"[Atlas] built {os.path.basename(path)} ({len(build_chars)} glyphs)")
+            if os.path.exists(path):
+                atlas = _map_atlas(path)
+        except (OSError, ValueError) as e:
+            print(f"[Atlas] size {size} unavailable, rasterizing in process: {e}")
+    _atlases[size] = atlas
+    return atlas
 
 
 # ── RENDERING PIPELINE ────────────────────────────────────────────────────────
@@ -83,8 +360,14 @@ def create_paper(draw):
     draw.line([(MARGIN_RIGHT, 0), (MARGIN_RIGHT, PAGE_H)], fill=MARGIN_RIGHT_COLOR, width=3)
 
 
+def _ink(alpha_min):
+    """A pen colour for one mark: INK shifted by up to INK_VARIATION, alpha from alpha_min to 255."""
+    v = random.randint(-INK_VARIATION, INK_VARIATION // 2)
+    return tuple(max(0, min(255, c + v)) for c in INK) + (random.randint(alpha_min, 255),)
+
+
 def render_char(canvas, char, cx, baseline_y, base_size,
-                rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04):
+                rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04, fallback=None):
     """
     Render a single character so its visual baseline sits on `baseline_y`.
 
@@ -95,9 +378,8 @@ def render_char(canvas, char, cx, baseline_y, base_size,
     size_delta = int(base_size * random.uniform(-size_var, size_var))
     char_size  = max(10, base_size + size_delta)
 
-    font, _ = _pick_font(char, char_size)
+    mask, bbox = glyph(char, char_size, fallback)
 
-    bbox   = font.getbbox(char)
     char_w = max(1, bbox[2] - bbox[0])
     char_h = max(4, bbox[3] - bbox[1])
     # ascent = distance from top of bbox to the drawing origin
@@ -105,16 +387,11 @@ def render_char(canvas, char, cx, baseline_y, base_size,
 
     pad  = 24
     tile = Image.new("RGBA", (char_w + pad * 2, char_h + pad * 2), (0, 0, 0, 0))
-    td   = ImageDraw.Draw(tile)
 
-    v   = random.randint(-INK_VARIATION, INK_VARIATION // 2)
-    ink = (max(0, min(255, INK[0] + v)),
-           max(0, min(255, INK[1] + v)),
-           max(0, min(255, INK[2] + v)),
-           random.randint(210, 255))
+    ink = _ink(210)
 
-    # Draw glyph inside the padded tile
-    td.text((pad - bbox[0], pad - bbox[1]), char, font=font, fill=ink)
+    # Fill the glyph's cached mask with ink inside the padded tile
+    tile.paste(ink, (pad, pad), mask)
 
     # Rotate the tile (expand=True keeps the full rotated image)
     angle      = random.uniform(-rotation, rotation)
@@ -152,23 +429,159 @@ def render_char(canvas, char, cx, baseline_y, base_size,
 
 
 def render_text_line(canvas, text, x_start, y_baseline, base_size,
-                     rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04):
+                     rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04, mode="glyph"):
+    if mode == "word":
+        return render_text_line_words(canvas, text, x_start, y_baseline, base_size,
+                                      rotation, noise, size_var, space_var)
+    if mode == "warp":
+        return render_text_line_warped(canvas, text, x_start, y_baseline, base_size,
+                                       rotation, noise, size_var, space_var)
     x = x_start
-    for char in text:
-        if char == " ":
-            x += int(base_size * 0.28) + random.randint(-WORD_SPACING_JITTER, WORD_SPACING_JITTER)
-            continue
-        x += render_char(canvas, char, x, y_baseline, base_size,
-                         rotation=rotation, noise=noise,
-                         size_var=size_var, space_var=space_var)
-        if x > MARGIN_RIGHT - 30:
-            break
+    for run, fallback in font_runs(text):
+        for char in run:
+            if char == " ":
+                x += int(base_size * 0.28) + random.randint(-WORD_SPACING_JITTER, WORD_SPACING_JITTER)
+                continue
+            x += render_char(canvas, char, x, y_baseline, base_size,
+                             rotation=rotation, noise=noise,
+                             size_var=size_var, space_var=space_var, fallback=fallback)
+            if x > MARGIN_RIGHT - 30:
+                return
+
+
+def render_word(canvas, word, x, baseline_y, base_size, fallback=None,
+                rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04, y_offset=0.0):
+    """
+    Word mode: compose a same-font run's cached glyph masks into one mask,
+    then ink, tilt and paste it once. Glyph bottoms sit on the baseline as
+    in render_char; the distortion is per word (size, tilt, ink, baseline
+    offset) with only the letter spacing still jittered per character.
+    Returns the advance in pixels.
+    """
+    char_size = max(10, base_size + int(base_size * random.uniform(-size_var, size_var)))
+    glyphs    = []
+    width = height = 0
+    for char in word:
+        mask, bbox = glyph(char, char_size, fallback)
+        char_w     = max(1, bbox[2] - bbox[0])
+        glyphs.append((mask, width))
+        width  += max(4, char_w + int(char_w * random.uniform(-space_var, space_var)))
+        height  = max(height, mask.height)
+
+    word_mask = Image.new("L", (width, height), 0)
+    for mask, gx in glyphs:
+        word_mask.paste(mask, (gx, height - mask.height), mask)
+
+    ink = _ink(220)
+    tile = Image.new("RGBA", word_mask.size, (0, 0, 0, 0))
+    tile.paste(ink, (0, 0), word_mask)
+
+    angle = math.degrees(random.uniform(-rotation, rotation) * WORD_TILT_SCALE)
+    if abs(angle) > 0.05:
+        tile = tile.rotate(angle, expand=True, resample=Image.BICUBIC)
+    # rotate(expand=True) keeps the centre, so re-centre on the unrotated box
+    dx = (tile.width - width) // 2
+    dy = (tile.height - height) // 2
+    canvas.paste(tile, (int(x) - dx, int(baseline_y - height + y_offset) - dy), tile)
+    return width
+
+
+def render_text_line_words(canvas, text, x_start, y_baseline, base_size,
+                           rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04):
+    """
+    render_text_line for word mode: one tile per word instead of per character.
+    The baseline drifts as a random walk along the line, bounded by the same
+    jitter range glyph mode uses per character.
+    """
+    max_drift = LINE_SPACING * noise
+    drift     = 0.0
+    x         = x_start
+    for run, fallback in font_runs(text):
+        for k, word in enumerate(run.split(" ")):
+            if k:
+                x += int(base_size * 0.28) + random.randint(-WORD_SPACING_JITTER, WORD_SPACING_JITTER)
+            if not word:
+                continue
+            drift = max(-max_drift, min(max_drift, drift + random.uniform(-0.5, 0.5) * max_drift))
+            x += render_word(canvas, word, x, y_baseline, base_size, fallback,
+                             rotation, noise, size_var, space_var, y_offset=drift)
+            if x > MARGIN_RIGHT - 30:
+                return
+
+
+def _warp_mesh(width, height, baseline, rotation, noise):
+    """
+    Image.MESH data for one smooth random displacement field over a line band:
+    a vertical baseline wobble (two sines, amplitude from `noise`) and a slant
+    that drifts along the line (from `rotation`). Messier settings give both a
+    larger amplitude and a shorter wavelength.
+    """
+    amp        = LINE_SPACING * noise * 3
+    slant      = rotation * 0.5
+    tilt       = random.uniform(-slant, slant) * 0.5
+    wavelength = WARP_WAVELENGTH / (1 + 3 * rotation)
+    p0, p1, p2 = (random.uniform(0, 2 * math.pi) for _ in range(3))
+
+    def field(px):
+        t = 2 * math.pi * px / wavelength
+        return (amp * (0.6 * math.sin(t + p0) + 0.4 * math.sin(2.2 * t + p1)),
+                tilt + slant * 0.5 * math.sin(0.6 * t + p2))
+
+    mesh, cols = [], list(range(0, width, WARP_CELL)) + [width]
+    dy0, s0 = field(cols[0])
+    for x0, x1 in zip(cols, cols[1:]):
+        dy1, s1 = field(x1)
+        # Source quad corners (UL, LL, LR, UR) for the destination column x0..x1
+        quad = (x0 + s0 * baseline, -dy0, x0 - s0 * (height - baseline), height - dy0,
+                x1 - s1 * (height - baseline), height - dy1, x1 + s1 * baseline, -dy1)
+        mesh.append(((x0, 0, x1, height), quad))
+        dy0, s0 = dy1, s1
+    return mesh
+
+
+def render_text_line_warped(canvas, text, x_start, y_baseline, base_size,
+                            rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04):
+    """
+    Warp mode: lay the line out straight as one mask from the cached glyphs,
+    then bend it with a single Image.transform(MESH) instead of rotating
+    every glyph. One size and ink per line; letter and word spacing keep
+    their per-character jitter so widths match measure_text_width.
+    """
+    char_size = max(10, base_size + int(base_size * random.uniform(-size_var, size_var)))
+    placed    = []
+    x = height = 0
+    for run, fallback in font_runs(text):
+        for char in run:
+            if x_start + x > MARGIN_RIGHT - 30:
+                break
+            if char == " ":
+                x += int(base_size * 0.28) + random.randint(-WORD_SPACING_JITTER, WORD_SPACING_JITTER)
+                continue
+            mask, bbox = glyph(char, char_size, fallback)
+            char_w     = max(1, bbox[2] - bbox[0])
+            placed.append((mask, x))
+            x     += max(4, char_w + int(char_w * random.uniform(-space_var, space_var)))
+            height = max(height, mask.height)
+    if not placed:
+        return
+
+    pad      = int(LINE_SPACING * noise * 3 + rotation * 0.5 * height) + 4
+    baseline = pad + height
+    band     = Image.new("L", (x + 2 * pad, height + 2 * pad), 0)
+    for mask, gx in placed:
+        band.paste(mask, (pad + gx, baseline - mask.height), mask)
+    band = band.transform(band.size, Image.MESH, _warp_mesh(band.width, band.height, baseline, rotation, noise),
+                          resample=Image.BICUBIC)
+
+    ink = _ink(220)
+    tile = Image.new("RGBA", band.size, (0, 0, 0, 0))
+    tile.paste(ink, (0, 0), band)
+    canvas.paste(tile, (int(x_start) - pad, int(y_baseline) - baseline), tile)
 
 
 def draw_underline(draw_canvas, x_start, y, text, size):
-    try:
-        font = ImageFont.truetype(FONT_PATH, size)
-    except Exception:
+    font = load_font(FONT_PATH, size)
+    if font is None:
         return
     bbox   = font.getbbox(text)
     text_w = bbox[2] - bbox[0]
@@ -189,13 +602,13 @@ def draw_underline(draw_canvas, x_start, y, text, size):
 def measure_text_width(text, font_size):
     """Measure how wide a string will render at a given font size."""
     total = 0
-    for char in text:
-        if char == " ":
-            total += int(font_size * 0.28)
-        else:
-            font, _ = _pick_font(char, font_size)
-            bbox     = font.getbbox(char)
-            total   += max(4, bbox[2] - bbox[0])
+    for run, fallback in font_runs(text):
+        for char in run:
+            if char == " ":
+                total += int(font_size * 0.28)
+            else:
+                bbox   = glyph(char, font_size, fallback)[1]
+                total += max(4, bbox[2] - bbox[0])
     return total
 
 
@@ -218,111 +631,172 @@ def wrap_text(text, x_start, font_size, max_x):
     return lines if lines else [text]
 
 
-def render_page(lines, rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04):
-    img    = Image.new("RGB",  (PAGE_W, PAGE_H), PAPER_BG)
-    canvas = Image.new("RGBA", (PAGE_W, PAGE_H), (0, 0, 0, 0))
-    draw_bg     = ImageDraw.Draw(img)
-    draw_canvas = ImageDraw.Draw(canvas)
-    create_paper(draw_bg)
-
-    margin = MARGIN_LEFT + 30
+class PageLayout:
+    """
+    Lays out one page a line at a time. `add()` places a notes line and
+    returns False (leaving the page untouched) once the line no longer fits,
+    so lines can be fed in as they arrive instead of all at once. Indent
+    jitter comes from `rng`; give it its own random.Random and the layout
+    no longer depends on how much randomness the drawing used.
+    """
 
-    # Pull the first # heading out and render it in the title area above the rules
-    title_line = None
-    start_i    = 0
-    for idx, line in enumerate(lines):
-        if line.strip():
+    def __init__(self, rng=None):
+        self.rng      = rng or random
+        self.margin   = MARGIN_LEFT + 30
+        self.ops      = []     # (text, x, baseline_y, font_size) in drawing order
+        self.count    = 0      # lines consumed
+        # Body starts on the second ruled line (title, if any, lives above the rules)
+        self.y        = FIRST_LINE_Y + LINE_SPACING * 2 + 4
+        self._started = False  # seen the first non-blank line?
+        self._leading = 0      # blank lines before it
+
+    def _fits(self, height):
+        # An empty page always takes the line, otherwise an oversized block
+        # would be pushed to the next page forever.
+        return not self.ops or self.y + height <= PAGE_H - 150
+
+    def _blank(self):
+        self.y += int(LINE_SPACING * 0.55)
+
+    def add(self, line):
+        raw = line.rstrip()
+
+        if not self._started:
+            if not line.strip():
+                self._leading += 1
+                self.count    += 1
+                return True
+            self._started = True
             if line.startswith("# "):
-                title_line = line
-                start_i    = idx + 1
-            break
-
-    if title_line:
-        title_text = title_line[2:].rstrip()
-        title_y    = FIRST_LINE_Y - 20
-        tx         = margin + random.randint(-4, 8)
-        render_text_line(canvas, title_text, tx, title_y, HEADING_SIZE,
-                         rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-        # Body starts on the second ruled line (title lives above the rules)
-        y = FIRST_LINE_Y + LINE_SPACING * 2 + 4
-    else:
-        # No title — skip the title gap, start on the second ruled line
-        y = FIRST_LINE_Y + LINE_SPACING * 2 + 4
-
-    i = start_i
-    while i < len(lines):
-        raw = lines[i].rstrip()
+                # Pull the first # heading out and render it in the title area above the rules
+                tx = self.margin + self.rng.randint(-4, 8)
+                self.ops.append((line[2:].rstrip(), tx, FIRST_LINE_Y - 20, HEADING_SIZE))
+                self.count += 1
+                return True
+            for _ in range(self._leading):
+                self._blank()
 
         if raw.startswith("# "):
-            text = raw[2:]
-            x    = margin + random.randint(-4, 8)
-            wrapped_lines = wrap_text(text, x, HEADING_SIZE, MARGIN_RIGHT - 20)
-            if y + int(LINE_SPACING * 2.2) * len(wrapped_lines) > PAGE_H - 150:
-                break
+            x = self.margin + self.rng.randint(-4, 8)
+            wrapped_lines = wrap_text(raw[2:], x, HEADING_SIZE, MARGIN_RIGHT - 20)
+            if not self._fits(int(LINE_SPACING * 2.2) * len(wrapped_lines)):
+                return False
             for j, wrapped in enumerate(wrapped_lines):
-                render_text_line(canvas, wrapped, x, y, HEADING_SIZE,
-                                 rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-                y += int(LINE_SPACING * 2.2) if j == len(wrapped_lines) - 1 else int(LINE_SPACING * 1.5)
+                self.ops.append((wrapped, x, self.y, HEADING_SIZE))
+                self.y += int(LINE_SPACING * 2.2) if j == len(wrapped_lines) - 1 else int(LINE_SPACING * 1.5)
 
         elif raw.startswith("## "):
-            text = raw[3:]
-            x    = margin + random.randint(-2, 6)
-            wrapped_lines = wrap_text(text, x, SUB_SIZE, MARGIN_RIGHT - 20)
-            if y + int(LINE_SPACING * 1.6) * len(wrapped_lines) > PAGE_H - 150:
-                break
+            x = self.margin + self.rng.randint(-2, 6)
+            wrapped_lines = wrap_text(raw[3:], x, SUB_SIZE, MARGIN_RIGHT - 20)
+            if not self._fits(int(LINE_SPACING * 1.6) * len(wrapped_lines)):
+                return False
             for j, wrapped in enumerate(wrapped_lines):
-                render_text_line(canvas, wrapped, x, y, SUB_SIZE,
-                                 rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-                y += int(LINE_SPACING * 1.6) if j == len(wrapped_lines) - 1 else int(LINE_SPACING * 1.1)
+                self.ops.append((wrapped, x, self.y, SUB_SIZE))
+                self.y += int(LINE_SPACING * 1.6) if j == len(wrapped_lines) - 1 else int(LINE_SPACING * 1.1)
 
         elif raw.startswith("  - "):
-            text = "- " + raw[4:]
-            x    = margin + 120 + random.randint(-4, 6)
-            cont = margin + 160
-            wrapped_lines = wrap_text(text, x, FONT_SIZE - 2, MARGIN_RIGHT - 20)
-            if y + LINE_SPACING * len(wrapped_lines) > PAGE_H - 150:
-                break
+            x    = self.margin + 120 + self.rng.randint(-4, 6)
+            cont = self.margin + 160
+            wrapped_lines = wrap_text("- " + raw[4:], x, FONT_SIZE - 2, MARGIN_RIGHT - 20)
+            if not self._fits(LINE_SPACING * len(wrapped_lines)):
+                return False
             for j, wrapped in enumerate(wrapped_lines):
-                render_text_line(canvas, wrapped, x if j == 0 else cont, y, FONT_SIZE - 2,
-                                 rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-                y += LINE_SPACING
+                self.ops.append((wrapped, x if j == 0 else cont, self.y, FONT_SIZE - 2))
+                self.y += LINE_SPACING
 
         elif raw.startswith("- "):
-            text = "- " + raw[2:]
-            x    = margin + 30 + random.randint(-4, 6)
-            cont = margin + 60
-            wrapped_lines = wrap_text(text, x, FONT_SIZE, MARGIN_RIGHT - 20)
-            if y + LINE_SPACING * len(wrapped_lines) > PAGE_H - 150:
-                break
+            x    = self.margin + 30 + self.rng.randint(-4, 6)
+            cont = self.margin + 60
+            wrapped_lines = wrap_text("- " + raw[2:], x, FONT_SIZE, MARGIN_RIGHT - 20)
+            if not self._fits(LINE_SPACING * len(wrapped_lines)):
+                return False
             for j, wrapped in enumerate(wrapped_lines):
-                render_text_line(canvas, wrapped, x if j == 0 else cont, y, FONT_SIZE,
-                                 rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-                y += LINE_SPACING
+                self.ops.append((wrapped, x if j == 0 else cont, self.y, FONT_SIZE))
+                self.y += LINE_SPACING
 
         elif raw == "":
-            y += int(LINE_SPACING * 0.55)
+            self._blank()
 
         else:
-            x = margin + random.randint(-4, 10)
+            x = self.margin + self.rng.randint(-4, 10)
             wrapped_lines = wrap_text(raw, x, FONT_SIZE, MARGIN_RIGHT - 20)
-            if y + LINE_SPACING * len(wrapped_lines) > PAGE_H - 150:
-                break
+            if not self._fits(LINE_SPACING * len(wrapped_lines)):
+                return False
             for wrapped in wrapped_lines:
-                render_text_line(canvas, wrapped, x, y, FONT_SIZE,
-                                 rotation=rotation, noise=noise, size_var=size_var, space_var=space_var)
-                y += LINE_SPACING
+                self.ops.append((wrapped, x, self.y, FONT_SIZE))
+                self.y += LINE_SPACING
 
-        i += 1
+        self.count += 1
+        return True
 
-    img.paste(
-        Image.alpha_composite(Image.new("RGBA", (PAGE_W, PAGE_H), (0, 0, 0, 0)), canvas).convert("RGB"),
-        mask=canvas.split()[3]
-    )
-    img = img.filter(ImageFilter.GaussianBlur(radius=1.2))
-    return img, lines[i:]
 
+_draft_paper = {}   # scale -> lined paper template
+
+def draft_paper(scale):
+    """The ruled page at `scale`, drawn once at full size, downsampled and kept as a template."""
+    paper = _draft_paper.get(scale)
+    if paper is None:
+        full = Image.new("RGB", (PAGE_W, PAGE_H), PAPER_BG)
+        create_paper(ImageDraw.Draw(full))
+        paper = _draft_paper[scale] = full.resize((round(PAGE_W * scale), round(PAGE_H * scale)),
+                                                  Image.LANCZOS)
+    return paper
 
-def render_notes_to_b64(notes_text, messiness=0.5):
+
+def draw_draft_page(ops, scale=DRAFT_SCALE):
+    """
+    Draft preset: the same ops as draw_page, drawn straight onto a copy of
+    the paper template at reduced size. No rotation, jitter, ink alpha,
+    RGBA canvas or blur; each glyph is one solid-ink paste of its cached
+    mask. Advances use the full-size glyph widths, so lines wrap and end
+    exactly where the full render's do.
+    """
+    img = draft_paper(scale).copy()
+    for text, x, y, size in ops:
+        small = max(6, round(size * scale))
+        for run, fallback in font_runs(text):
+            for char in run:
+                if x > MARGIN_RIGHT - 30:
+                    break
+                if char == " ":
+                    x += int(size * 0.28)
+                    continue
+                mask, _ = glyph(char, small, fallback)
+                bbox    = glyph(char, size, fallback)[1]
+                img.paste(INK, (round(x * scale), round(y * scale) - mask.height), mask)
+                x += max(4, bbox[2] - bbox[0])
+    return img
+
+
+def draw_page(ops, rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04, mode="glyph"):
+    """Rasterize a laid-out page (PageLayout.ops) onto lined paper."""
+    if mode == "draft":
+        return draw_draft_page(ops)
+    img    = Image.new("RGB",  (PAGE_W, PAGE_H), PAPER_BG)
+    canvas = Image.new("RGBA", (PAGE_W, PAGE_H), (0, 0, 0, 0))
+    draw_bg = ImageDraw.Draw(img)
+    create_paper(draw_bg)
+
+    for text, x, y, size in ops:
+        render_text_line(canvas, text, x, y, size, rotation=rotation, noise=noise,
+                         size_var=size_var, space_var=space_var, mode=mode)
+
+    # The canvas is its own mask: no extra full-page composite/RGB/alpha copies
+    img.paste(canvas, mask=canvas)
+    del canvas, draw_bg
+    return img.filter(ImageFilter.GaussianBlur(radius=1.2))
+
+
+def render_page(lines, rotation=0.2, noise=0.08, size_var=0.02, space_var=0.04, mode="glyph"):
+    layout = PageLayout()
+    for line in lines:
+        if not layout.add(line):
+            break
+    img = draw_page(layout.ops, rotation, noise, size_var, space_var, mode)
+    return img, lines[layout.count:]
+
+
+def _messiness_params(messiness):
     # Keep rotation gentle so text stays inside ruled lines.
     # Even at messiness=1.0 the per-char tilt is max ~4°, which looks messy
     # but still readable and on the line.
@@ -330,53 +804,604 @@ def render_notes_to_b64(notes_text, messiness=0.5):
     noise     = messiness * 0.06    # baseline jitter as fraction of line spacing
     size_var  = messiness * 0.04
     space_var = messiness * 0.06
+    return rotation, noise, size_var, space_var
 
-    remaining = notes_text.strip().split("\n")
-    images    = []
-    while remaining:
-        img, remaining = render_page(remaining, rotation, noise, size_var, space_var)
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        images.append(base64.b64encode(buf.getvalue()).decode())
-        if not remaining:
-            break
-    return images
+
+RENDER_MODES = ("glyph", "word", "warp", "draft", "auto")
+
+def resolve_render_mode(mode, messiness):
+    """The drawing mode for a render: `mode` or RENDER_MODE, with "auto" settled by messiness."""
+    mode = mode or RENDER_MODE
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {mode!r} (expected one of {', '.join(RENDER_MODES)})")
+    if mode == "auto":
+        return "word" if messiness <= AUTO_WORD_MESSINESS else "glyph"
+    return mode
+
+
+class PagePlan:
+    """
+    The layout pass, run ahead of rasterization on its own thread. Each page's
+    ops are queued as soon as the page is full, and `total` is set once the
+    notes end. Notes that are already complete (a cache hit) are laid out in
+    full before the first page is drawn, so the page count is known up front;
+    streamed notes learn it when the LLM finishes. With a `job`, waiting for
+    the next page gives up as soon as the job is cancelled.
+    """
+
+    def __init__(self, lines, rng, timer, job=None):
+        self.total   = None
+        self.done    = threading.Event()   # set once `total` is known
+        self._job    = job
+        self._queue  = queue.Queue()
+        self._closed = threading.Event()
+        threading.Thread(target=self._run, args=(lines, rng, timer), name="layout", daemon=True).start()
+
+    def _run(self, lines, rng, timer):
+        try:
+            layout, pages = PageLayout(rng), 0
+            for line in lines:
+                if self._closed.is_set():
+                    return
+                with timer.stage("layout"):
+                    fits = layout.add(line)
+                if not fits:
+                    self._queue.put(layout.ops)
+                    pages += 1
+                    with timer.stage("layout"):
+                        layout = PageLayout(rng)
+                        layout.add(line)
+            if layout.count or not pages:
+                self._queue.put(layout.ops)
+                pages += 1
+            self.total = pages
+            self.done.set()
+            self._queue.put(None)
+        except BaseException as e:   # re-raised on the rendering side
+            self._queue.put(e)
+        finally:
+            # Shut the notes source down now (LLM stream, chunk pool, PDF pages), not whenever it is collected
+            close = getattr(lines, "close", None)
+            if close:
+                close()
+
+    def _next(self):
+        if not self._job:
+            return self._queue.get()
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                self._job.check()
+
+    def __iter__(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self):
+        self._closed.set()
+
+
+def render_notes_stream(lines, messiness=0.5, timer=None, mode=None, layout_seed=0, on_page=None,
+                        job=None):
+    """
+    Yield finished page images while `lines` is still being produced: a page
+    is rasterized as soon as the layout pass has filled it.
+    Layout draws from its own RNG seeded with `layout_seed`, so every render
+    mode (draft included) breaks the same notes into the same pages.
+
+    `on_page(page, total, eta)` is called before each page is drawn. `total`
+    is None until the notes have ended; `eta` (seconds) comes from the last
+    few pages' measured cost, raster plus whatever the caller does with the
+    page before asking for the next one. A cancelled `job` raises
+    JobCancelled before the next page is drawn.
+    """
+    timer  = timer or PipelineTimer()
+    params = _messiness_params(messiness) + (resolve_render_mode(mode, messiness),)
+    plan   = PagePlan(lines, random.Random(layout_seed), timer, job)
+    costs  = deque(maxlen=5)
+    try:
+        for page, ops in enumerate(plan, 1):
+            if job:
+                job.check()
+            if page == 1:
+                plan.done.wait(LAYOUT_HEAD_START)
+            if on_page:
+                eta = None
+                if costs and plan.total:
+                    eta = sum(costs) / len(costs) * (plan.total - page + 1)
+                on_page(page, plan.total, eta)
+            t0 = time.perf_counter()
+            with timer.stage("raster"):
+                img = draw_page(ops, *params)
+            timer.count("pages", 1)
+            yield img
+            costs.append(time.perf_counter() - t0)
+    finally:
+        plan.close()
+
+
+def encode_page(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def render_notes_to_b64(notes_text, messiness=0.5, mode=None):
+    return [encode_page(img)
+            for img in render_notes_stream(notes_text.strip().split("\n"), messiness, mode=mode)]
+
+
+# ── RESULT CACHE ──────────────────────────────────────────────────────────────
+
+class TieredCache:
+    """
+    String key/value cache with an in-memory LRU in front of an optional
+    SQLite table on disk. Entries older than `max_age` seconds count as
+    misses; memory is capped by entry count, disk by total value bytes
+    (least recently used rows go first).
+    """
+
+    def __init__(self, name, path=None, max_entries=128, max_bytes=256 << 20, max_age=None):
+        self.name        = name
+        self.path        = path
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.max_age     = max_age
+        self._mem        = OrderedDict()   # key -> (created_at, value)
+        self._lock       = threading.Lock()
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with self._connect() as db:
+                    db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                               "created_at REAL NOT NULL, used_at REAL NOT NULL)")
+            except sqlite3.Error as e:
+                print(f"[Cache] {name}: disk tier disabled ({e})")
+                self.path = None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _expired(self, created_at, now):
+        return self.max_age is not None and now - created_at > self.max_age
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if not self._expired(hit[0], now):
+                    self._mem.move_to_end(key)
+                    return hit[1]
+                del self._mem[key]
+        if not self.path:
+            return None
+        try:
+            with self._connect() as db:
+                row = db.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if self._expired(row[1], now):
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return None
+                db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"[Cache] {self.name}: read failed ({e})")
+            return None
+        self._remember(key, row[1], row[0])
+        return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        self._remember(key, now, value)
+        if not self.path:
+            return
+        try:
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                           (key, value, len(value.encode()), now, now))
+                self._evict(db, now)
+        except sqlite3.Error as e:
+            print(f"[Cache] {self.name}: write failed ({e})")
+
+    def _remember(self, key, created_at, value):
+        with self._lock:
+            self._mem[key] = (created_at, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def _evict(self, db, now):
+        if self.max_age is not None:
+            db.execute("DELETE FROM entries WHERE created_at < ?", (now - self.max_age,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY used_at").fetchall():
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+extract_cache = TieredCache("extract", EXTRACT_CACHE_PATH or None,
+                            max_entries=EXTRACT_CACHE_ITEMS,
+                            max_bytes=EXTRACT_CACHE_MAX_MB << 20,
+                            max_age=CACHE_MAX_AGE)
+
+notes_cache = TieredCache("notes", NOTES_CACHE_PATH or None,
+                          max_entries=NOTES_CACHE_ENTRIES,
+                          max_bytes=NOTES_CACHE_MAX_MB << 20,
+                          max_age=CACHE_MAX_AGE)
+
+
+# ── LLM BACKENDS ─────────────────────────────────────────────────────────────
+
+class LLMBackend(ABC):
+    """
+    The two calls the pipeline makes to a chat model. `complete` returns
+    the whole reply; `stream` yields it in pieces as they are generated.
+    A backend missing either one fails when it is created, not mid-job.
+    """
+    name = "base"
+
+    @abstractmethod
+    def complete(self, model, messages, max_tokens=None):
+        ...
+
+    @abstractmethod
+    def stream(self, model, messages):
+        ...
+
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, api_key=None):
+        self.client = lazy_import("openai").OpenAI(api_key=api_key or OPENAI_API_KEY)
+
+    def complete(self, model, messages, max_tokens=None):
+        kwargs   = {"max_tokens": max_tokens} if max_tokens else {}
+        response = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content or ""
+
+    def stream(self, model, messages):
+        response = self.client.chat.completions.create(model=model, messages=messages, stream=True)
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        finally:
+            response.close()   # a cancelled job hangs up rather than reading the rest of the reply
+
+
+# name -> (seconds to first token, tokens per second); roughly what the real
+# models deliver, so offline runs have realistic LLM-stage timings
+FAKE_LLM_PROFILES = {
+    "instant":     (0.0, None),
+    "gpt-4o-mini": (0.6, 90.0),
+    "gpt-4o":      (1.2, 45.0),
+    "slow":        (3.0, 20.0),
+}
+
+
+class FakeBackend(LLMBackend):
+    """
+    Offline stand-in for benchmarking and load tests. Replies are built
+    from the prompt itself (same prompt, same reply) and paced by a
+    latency / token-rate profile, so no network or API spend is involved.
+    """
+    name = "fake"
+
+    def __init__(self, latency=0.0, tokens_per_sec=None):
+        self.latency        = latency
+        self.tokens_per_sec = tokens_per_sec
+
+    @classmethod
+    def from_profile(cls, profile):
+        if profile not in FAKE_LLM_PROFILES:
+            raise ValueError(f"Unknown fake LLM profile: {profile!r} "
+                             f"(choose from {', '.join(FAKE_LLM_PROFILES)})")
+        return cls(*FAKE_LLM_PROFILES[profile])
+
+    def reply(self, messages):
+        content = messages[-1]["content"]
+        if isinstance(content, list):   # vision request
+            image = next(p["image_url"]["url"] for p in content if p["type"] == "image_url")
+            digest = hashlib.sha256(image.encode()).hexdigest()[:12]
+            return f"Slide {digest}\nExtracted text for image {digest}\n- point one\n- point two"
+        return self._fake_notes(content.split("Lecture content:\n", 1)[-1])
+
+    @staticmethod
+    def _fake_notes(lecture):
+        rng   = random.Random(hashlib.sha256(lecture.encode()).digest())
+        out   = ["# Lecture Notes"]
+        for block in re.split(r'\n\s*\n', lecture):
+            block_lines = [l.strip() for l in block.splitlines() if l.strip()]
+            if not block_lines:
+                continue
+            out.append("## " + block_lines[0][:60])
+            for line in block_lines[1:]:
+                words = line.split()
+                for k in range(0, len(words), 12):
+                    out.append("- " + " ".join(words[k:k + 12]))
+                    if rng.random() < 0.2:
+                        out.append("  - " + " ".join(rng.sample(words, min(5, len(words)))))
+        return "\n".join(out)
+
+    @staticmethod
+    def _tokens(text):
+        # ~4 characters per token, like the OpenAI tokenizers on English prose
+        return [text[k:k + 4] for k in range(0, len(text), 4)]
+
+    def complete(self, model, messages, max_tokens=None):
+        text   = self.reply(messages)
+        tokens = self._tokens(text)[:max_tokens] if max_tokens else self._tokens(text)
+        delay  = self.latency + (len(tokens) / self.tokens_per_sec if self.tokens_per_sec else 0)
+        if delay:
+            time.sleep(delay)
+        return "".join(tokens)
+
+    def stream(self, model, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        for token in self._tokens(self.reply(messages)):
+            if self.tokens_per_sec:
+                time.sleep(1 / self.tokens_per_sec)
+            yield token
+
+
+_llm_backend      = None
+_llm_backend_lock = threading.Lock()
+
+def get_llm_backend():
+    """The process-wide backend, picked by LLM_BACKEND (openai | fake)."""
+    global _llm_backend
+    with _llm_backend_lock:
+        if _llm_backend is None:
+            if LLM_BACKEND == "fake":
+                _llm_backend = FakeBackend.from_profile(FAKE_LLM_PROFILE)
+            elif LLM_BACKEND == "openai":
+                _llm_backend = OpenAIBackend()
+            else:
+                raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND!r}")
+        return _llm_backend
+
+def set_llm_backend(backend):
+    """Swap the backend, e.g. for a FakeBackend in benchmarks."""
+    global _llm_backend
+    with _llm_backend_lock:
+        _llm_backend = backend
 
 
 # ── GPT CALL ─────────────────────────────────────────────────────────────────
 
-def extract_from_pdf(file_bytes):
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    text = "\n\n".join(page.get_text() for page in doc)
+def _open_pdf(source):
+    """Open a PDF given as bytes or as a path (uploads big enough to be spooled to disk)."""
+    if isinstance(source, str):
+        return lazy_import("fitz").open(source, filetype="pdf")
+    return lazy_import("fitz").open(stream=source, filetype="pdf")
+
+def _pdf_page_content(page):
+    """
+    (text, png) for one page. Pages with no text layer but with embedded
+    images (scans, slide screenshots) are rasterized for OCR instead.
+    """
+    text = page.get_text()
+    if text.strip() or not page.get_images():
+        return text, None
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=lazy_import("fitz").csGRAY)
+    return "", pix.tobytes("png")
+
+def _pdf_range_pages(source, start, stop):
+    """Pool worker: content of pages [start, stop), from its own copy of the document."""
+    doc = _open_pdf(source)
+    try:
+        return [_pdf_page_content(doc[i]) for i in range(start, stop)]
+    finally:
+        doc.close()
+
+_pdf_pool      = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn, not fork: the server is multi-threaded by the time the first big PDF arrives
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+def _iter_pdf_content(source, doc=None):
+    """
+    (text, png) per page in page order, read in parallel page ranges for large
+    documents. `doc` is the already opened `source`, if the caller has it.
+    """
+    doc = doc or _open_pdf(source)
+    n   = doc.page_count
+    if n < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        try:
+            for page in doc:
+                yield _pdf_page_content(page)
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    pool    = _get_pdf_pool()
+    # A spooled upload is passed by path, so workers don't each get a pickled copy of the bytes
+    futures = [pool.submit(_pdf_range_pages, source, k, min(k + PDF_PAGES_PER_TASK, n))
+               for k in range(0, n, PDF_PAGES_PER_TASK)]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _ocr_page(png):
+    try:
+        return extract_from_image(png, "page.png")
+    except ValueError:   # nothing readable on the page
+        return ""
+
+def iter_pdf_pages(source, doc=None):
+    """
+    Yield each page's text in page order. Large documents are split into
+    page ranges extracted in parallel worker processes; pages are yielded
+    as soon as their range is done, so early pages are available while
+    later ones are still being read.
+
+    Image-only pages go through vision extraction, OCR_CONCURRENCY at a
+    time; identical page images are only sent once. Past OCR_MAX_PAGES
+    distinct images the rest are skipped, and a closing "[N pages not
+    OCR'd]" marker says so.
+    """
+    ocr     = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY)
+    jobs    = {}         # png sha256 -> future
+    pending = deque()    # page text, or the future that will produce it
+    skipped = 0
+    try:
+        for text, png in _iter_pdf_content(source, doc):
+            if png is None:
+                pending.append(text)
+            else:
+                digest = hashlib.sha256(png).hexdigest()
+                if digest not in jobs:
+                    if len(jobs) >= OCR_MAX_PAGES:
+                        pending.append("")
+                        skipped += 1
+                        continue
+                    jobs[digest] = ocr.submit(_ocr_page, png)
+                pending.append(jobs[digest])
+            while pending and (isinstance(pending[0], str) or pending[0].done()):
+                item = pending.popleft()
+                yield item if isinstance(item, str) else item.result()
+        for item in pending:
+            yield item if isinstance(item, str) else item.result()
+        if jobs:
+            print(f"[Extract] OCR'd {len(jobs)} image-only PDF pages"
+                  + (f", skipped {skipped} over OCR_MAX_PAGES={OCR_MAX_PAGES}" if skipped else ""))
+        if skipped:
+            yield f"[{skipped} page{'s' if skipped != 1 else ''} not OCR'd]"
+    finally:
+        ocr.shutdown(wait=False, cancel_futures=True)
+
+def extract_from_pdf(source, doc=None):
+    text = "\n\n".join(iter_pdf_pages(source, doc))
     if not text.strip():
-        raise ValueError("Could not extract text from Lecture (might be scanned/image-based)")
+        raise ValueError("Could not extract text from Lecture (no text layer and no readable images)")
     return text
 
-def extract_from_pptx(file_bytes):
-    prs = Presentation(io.BytesIO(file_bytes))
-    slides = []
-    for i, slide in enumerate(prs.slides):
-        parts = []
-        for shape in slide.shapes:
-            if shape.has_text_frame:
-                for para in shape.text_frame.paragraphs:
-                    line = para.text.strip()
-                    if line:
-                        parts.append(line)
+_DRAWINGML_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_PRESENTML_NS = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_OFFICE_REL   = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+def _pptx_slide_parts(zf):
+    """Zip entry names of the slides, in presentation order."""
+    names = set(zf.namelist())
+    try:
+        pres = ET.fromstring(zf.read("ppt/presentation.xml"))
+        rels = ET.fromstring(zf.read("ppt/_rels/presentation.xml.rels"))
+    except KeyError:
+        pres = None
+    if pres is not None:
+        targets = {rel.get("Id"): rel.get("Target", "") for rel in rels}
+        parts   = []
+        for sld in pres.iter(_PRESENTML_NS + "sldId"):
+            target = targets.get(sld.get(_OFFICE_REL), "")
+            name   = target.lstrip("/") if target.startswith("/") else posixpath.normpath("ppt/" + target)
+            if name in names:
+                parts.append(name)
         if parts:
-            slides.append(f"[Slide {i+1}]\n" + "\n".join(parts))
+            return parts
+    # No usable presentation.xml: fall back to slideN numbering
+    slides = [n for n in names if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)]
+    return sorted(slides, key=lambda n: int(re.search(r"(\d+)\.xml$", n).group(1)))
+
+def _iter_slide_paragraphs(xml_file):
+    """
+    Paragraph text from one slide's XML, in document order. Every <a:p>
+    counts, so text inside grouped shapes and table cells is included.
+    """
+    runs = []
+    for _, el in ET.iterparse(xml_file, events=("end",)):
+        if el.tag == _DRAWINGML_NS + "t":
+            runs.append(el.text or "")
+        elif el.tag == _DRAWINGML_NS + "br":
+            runs.append(" ")
+        elif el.tag == _DRAWINGML_NS + "p":
+            line = "".join(runs).strip()
+            runs.clear()
+            el.clear()
+            if line:
+                yield line
+
+def extract_from_pptx(source):
+    # Read the slide XML straight from the zip instead of loading the whole
+    # package (media included) through python-pptx.
+    try:
+        zf = zipfile.ZipFile(source if isinstance(source, str) else io.BytesIO(source))
+    except zipfile.BadZipFile:
+        raise ValueError("Could not read PPTX file")
+    slides = []
+    with zf:
+        for i, part in enumerate(_pptx_slide_parts(zf)):
+            with zf.open(part) as xml_file:
+                parts = list(_iter_slide_paragraphs(xml_file))
+            if parts:
+                slides.append(f"[Slide {i+1}]\n" + "\n".join(parts))
     text = "\n\n".join(slides)
     if not text.strip():
         raise ValueError("Could not extract text from PPTX")
     return text
 
+IMAGE_MIME = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def prepare_vision_image(file_bytes, filename):
+    """
+    Shrink an upload before it goes to the vision model: apply the EXIF
+    rotation, cap the long edge at VISION_MAX_EDGE, drop colour and
+    re-encode as JPEG. Text stays just as legible, but a phone photo goes
+    from megabytes to ~100-300 KB. Returns (bytes, mime).
+    """
+    ext  = filename.rsplit(".", 1)[-1].lower()
+    mime = IMAGE_MIME.get(ext, "image/jpeg")
+    try:
+        img     = Image.open(io.BytesIO(file_bytes))
+        changed = img.getexif().get(0x0112, 1) != 1   # EXIF orientation tag
+        img     = ImageOps.exif_transpose(img)
+        if max(img.size) > VISION_MAX_EDGE:
+            img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+            changed = True
+        if "A" in img.getbands() or "transparency" in img.info:
+            # Flatten onto white first: dark text on a transparent background would otherwise go solid black
+            img = Image.alpha_composite(Image.new("RGBA", img.size, (255, 255, 255, 255)), img.convert("RGBA"))
+        buf = io.BytesIO()
+        img.convert("L").save(buf, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        print(f"[Vision] could not prepare {filename} ({e}), sending as-is")
+        return file_bytes, mime
+    # Small screenshots are often smaller as the original PNG; keep that unless we had to rotate/resize
+    if not changed and buf.tell() >= len(file_bytes):
+        return file_bytes, mime
+    return buf.getvalue(), "image/jpeg"
+
 def extract_from_image(file_bytes, filename):
-    client   = OpenAI(api_key=OPENAI_API_KEY)
-    img_b64  = base64.b64encode(file_bytes).decode()
-    ext      = filename.rsplit(".", 1)[-1].lower()
-    mime     = "image/png" if ext == "png" else "image/jpeg"
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    t0         = time.perf_counter()
+    data, mime = prepare_vision_image(file_bytes, filename)
+    img_b64    = base64.b64encode(data).decode()
+    t1         = time.perf_counter()
+    text       = get_llm_backend().complete(
+        model=VISION_MODEL,
         messages=[{
             "role": "user",
             "content": [
@@ -388,35 +1413,105 @@ def extract_from_image(file_bytes, filename):
             ]
         }],
         max_tokens=4000
-    )
-    text = response.choices[0].message.content.strip()
+    ).strip()
+    t2 = time.perf_counter()
+    print(f"[Vision] {filename}: {len(file_bytes) // 1024} KB -> {len(data) // 1024} KB ({mime}), "
+          f"payload {len(img_b64) // 1024} KB, prepare+encode {(t1 - t0) * 1000:.0f} ms, "
+          f"vision {(t2 - t1) * 1000:.0f} ms")
     if not text:
         raise ValueError("Could not extract text from image")
     return text
 
-def extract_from_upload(file_bytes, filename):
+def _source_bytes(source):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    return source
+
+def _source_sha256(source):
+    if not isinstance(source, str):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_from_upload(source, filename, stream_pages=False):
+    """
+    Text of an upload given as bytes or as a path to the spooled file.
+
+    With `stream_pages`, a large PDF (PDF_PARALLEL_MIN_PAGES or more) that is
+    not in the cache comes back as an iterator of page texts instead, so notes
+    can be started on early pages while later ones are still being read. The
+    joined text is cached once the last page is out.
+    """
     ext = filename.rsplit(".", 1)[-1].lower()
     if ext == "pdf":
-        return extract_from_pdf(file_bytes)
+        extract = extract_from_pdf
     elif ext == "pptx":
-        return extract_from_pptx(file_bytes)
+        extract = extract_from_pptx
     elif ext in ("png", "jpg", "jpeg", "webp"):
-        return extract_from_image(file_bytes, filename)
+        extract = lambda src: extract_from_image(_source_bytes(src), filename)
     else:
         raise ValueError(f"Unsupported file type: .{ext}")
 
-def generate_notes(raw_text, detail=0.5, custom_instructions=""):
-    words = raw_text.split()
-    if len(words) > 6000:
-        raw_text = " ".join(words[:6000]) + "\n[truncated]"
+    # Same bytes, same text: re-uploads skip parsing (and, for images, the vision call)
+    cache_key = _extract_cache_key(source, ext)
+    cached    = extract_cache.get(cache_key)
+    if cached is not None:
+        print(f"[Cache] extract hit {cache_key.rsplit(':', 1)[1][:12]} ({ext})")
+        return cached
+    if stream_pages and ext == "pdf":
+        doc = _open_pdf(source)
+        if doc.page_count >= PDF_PARALLEL_MIN_PAGES:
+            return _cache_pages(iter_pdf_pages(source, doc), cache_key)
+        extract = lambda src: extract_from_pdf(src, doc)
+    text = extract(source)
+    extract_cache.set(cache_key, text)
+    return text
 
+def _cache_pages(pages, cache_key):
+    texts = []
+    for text in pages:
+        texts.append(text)
+        yield text
+    text = "\n\n".join(texts)
+    if not text.strip():
+        raise ValueError("Could not extract text from Lecture (no text layer and no readable images)")
+    extract_cache.set(cache_key, text)
+
+def _extract_cache_key(source, ext):
+    return f"{EXTRACTOR_VERSION}:{get_llm_backend().name}:{ext}:{_source_sha256(source)}"
+
+def _detail_bucket(detail):
+    """Collapse the detail slider into the three prompt variants."""
     if detail < 0.33:
+        return "low"
+    if detail < 0.67:
+        return "medium"
+    return "high"
+
+def notes_cache_key(raw_text, detail, custom_instructions):
+    """Hash of everything that changes the notes GPT would write."""
+    parts = (
+        " ".join(raw_text.split()),
+        _detail_bucket(detail),
+        " ".join(custom_instructions.split()),
+        get_llm_backend().name,
+        NOTES_MODEL,
+        NOTES_PROMPT_VERSION,
+    )
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def _notes_prompt(raw_text, bucket, custom_instructions, part=None, parts=None):
+    if bucket == "low":
         detail_instruction = (
             "- Write HIGH-LEVEL summary notes only — key topics and main ideas, no deep explanations\n"
             "- Keep bullets short, one line max\n"
             "- Aim for brevity: a student reviewing quickly before an exam"
         )
-    elif detail < 0.67:
+    elif bucket == "medium":
         detail_instruction = (
             "- Include specific terms, definitions, and mechanisms with brief explanations\n"
             "- Aim for the level of detail a diligent student would write\n"
@@ -434,12 +1529,16 @@ def generate_notes(raw_text, detail=0.5, custom_instructions=""):
     if custom_instructions.strip():
         custom_block = f"\nAdditional instructions from the student:\n{custom_instructions.strip()}\n"
 
-    client   = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{
-            "role": "user",
-            "content": f"""Rewrite these lecture slides as handwritten student notes.
+    part_block = ""
+    if part and parts != 1:
+        # parts is None while the lecture is still being extracted and the count isn't known
+        of = f" of {parts}" if parts else ""
+        part_block = (f"\nThis is part {part}{of} of a longer lecture. "
+                      "Cover only the content below; the other parts are handled separately.\n")
+        if part > 1:
+            part_block += "Do NOT start with a # main title — continue straight into the topics.\n"
+
+    return f"""Rewrite these lecture slides as handwritten student notes.
 
 Rules:
 {detail_instruction}
@@ -455,58 +1554,882 @@ Rules:
     plain paragraph text for explanations
 - Abbreviations are fine (w/, b/c, approx, etc.)
 - Do NOT write a summary, conclusion, or closing paragraph at the end — stop after the last topic
-{custom_block}
+{custom_block}{part_block}
 Lecture content:
 {raw_text}"""
-        }]
-    )
-    text = response.choices[0].message.content
-    import re
-    text = re.sub(r'^```[a-zA-Z]*\n?', '', text.strip())
-    text = re.sub(r'\n?```$', '', text.strip())
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.+?)\*', r'\1', text)
-    text = re.sub(r'^#{3,}\s*', '## ', text, flags=re.MULTILINE)
-
-    # Strip any trailing summary/conclusion paragraph GPT sneaks in.
-    # These tend to be plain paragraphs starting with summary-ish phrases
-    # at the very end of the output (after the last heading/bullet block).
-    summary_triggers = (
-        'in summary', 'in conclusion', 'overall,', 'to summarize',
-        'this outline', 'this overview', 'these notes', 'understanding',
-        'in short,', 'taken together', 'together, these',
-    )
-    lines = text.split('\n')
-    # Walk backwards, drop trailing plain-text paragraphs that look like summaries
-    while lines:
-        last = lines[-1].strip().lower()
-        if not last:
-            lines.pop()
+
+
+# Trailing summary/conclusion paragraphs GPT sneaks in despite the prompt.
+# These tend to be plain paragraphs starting with summary-ish phrases
+# at the very end of the output (after the last heading/bullet block).
+SUMMARY_TRIGGERS = (
+    'in summary', 'in conclusion', 'overall,', 'to summarize',
+    'this outline', 'this overview', 'these notes', 'understanding',
+    'in short,', 'taken together', 'together, these',
+)
+
+def _maybe_trailing(line):
+    """True if this line would be dropped were it at the end of the notes."""
+    last = line.strip().lower()
+    if not last:
+        return True
+    return (not last.startswith('#') and not last.startswith('-')
+            and any(last.startswith(t) for t in SUMMARY_TRIGGERS))
+
+
+def _clean_note_lines(raw_lines):
+    """
+    Strip the markdown GPT adds despite being told not to, one line at a
+    time so it can run on a streamed completion. Blank and summary-looking
+    lines are held back until a later line shows they are not trailing;
+    whatever is still held when the input ends is dropped.
+    """
+    held    = []
+    started = False
+    for line in raw_lines:
+        if re.match(r'^\s*```[a-zA-Z]*\s*$', line):
             continue
-        if (not last.startswith('#') and not last.startswith('-')
-                and any(last.startswith(t) for t in summary_triggers)):
-            lines.pop()
-        else:
+        line = re.sub(r'\*\*(.+?)\*\*', r'\1', line)
+        line = re.sub(r'\*(.+?)\*', r'\1', line)
+        line = re.sub(r'^#{3,}\s*', '## ', line)
+        if not started:
+            if not line.strip():
+                continue
+            line    = line.lstrip()
+            started = True
+        if _maybe_trailing(line):
+            held.append(line)
+            continue
+        yield from held
+        held.clear()
+        yield line
+
+
+def _clean_notes(text):
+    return '\n'.join(_clean_note_lines(text.split('\n')))
+
+
+_encoding = None
+
+def count_tokens(text):
+    """Prompt tokens for NOTES_MODEL: exact with tiktoken installed, else ~4 chars per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(NOTES_MODEL)
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+# Bare page numbers: "12", "p. 12", "Page 3 of 40", "7 / 52"
+_PAGE_NUMBER_RE = re.compile(r'^(page|slide|p\.?)?\s*\d+\s*((/|of)\s*\d+)?$', re.IGNORECASE)
+
+def _boilerplate_key(line):
+    # Ignore a leading/trailing number so "CS 101 - Lecture 4 - 12" matches on every page
+    return re.sub(r'^\d+\W*|\W*\d+$', '#', line.lower())
+
+_FIGURE_RE = re.compile(r'^[\d.,%+-]+$')
+
+def _line_keys(lines):
+    """
+    (line, repeat key, is_page_number) for each line of a block. Headers,
+    footers and page numbers sit on a block's first and last line, so only
+    there is a number ignored; in between, "Example 1" / "Example 2" and
+    numeric table cells are content. An edge number next to another number
+    is the end of a column of figures, not a page number.
+    """
+    last, out = len(lines) - 1, []
+    for k, line in enumerate(lines):
+        if k not in (0, last):
+            out.append((line, line.lower(), False))
+            continue
+        neighbour = lines[1 if k == 0 else last - 1] if last else ""
+        is_page   = bool(_PAGE_NUMBER_RE.match(line)) and not _FIGURE_RE.match(neighbour)
+        out.append((line, _boilerplate_key(line), is_page))
+    return out
+
+def compact_lecture_text(raw_text, budget=None):
+    """
+    Shrink the lecture text before it goes into a prompt: collapse
+    whitespace, drop bare page numbers and any short line (header, footer,
+    course code) that repeats on a large share of the pages/slides, then
+    cut to `budget` tokens at a block boundary. Returns (text, tokens_saved).
+    """
+    budget = budget or NOTES_TOKEN_BUDGET
+    blocks = []
+    for block in re.split(r'\n\s*\n', raw_text):
+        lines = [" ".join(line.split()) for line in block.split("\n")]
+        lines = [line for line in lines if line]
+        if lines:
+            blocks.append(lines)
+
+    blocks  = [_line_keys(lines) for lines in blocks]
+    repeats = {}
+    for lines in blocks:
+        for key in {key for line, key, _ in lines if len(line) <= 80}:
+            repeats[key] = repeats.get(key, 0) + 1
+    # Too few pages to tell boilerplate from a short deck that repeats itself
+    threshold = max(3, int(len(blocks) * 0.3)) if len(blocks) >= 5 else len(blocks) + 1
+
+    def keep(line, key, is_page_number):
+        if line.startswith("[Slide "):
+            return True
+        if is_page_number:
+            return False
+        return len(line) > 80 or repeats.get(key, 0) < threshold
+
+    kept = []
+    for lines in blocks:
+        block = "\n".join(line for line, key, is_page_number in lines if keep(line, key, is_page_number))
+        if block and not (block.startswith("[Slide ") and "\n" not in block):
+            kept.append(block)
+    if not kept:
+        # Everything looked like boilerplate; better to send it all than nothing
+        kept = ["\n".join(line for line, _, _ in lines) for lines in blocks]
+
+    out, used = [], 0
+    for block in kept:
+        tokens = count_tokens(block)
+        if used + tokens > budget:
+            if not out:   # a single huge block: keep its head
+                out.append(block[:budget * 4])
+            out.append("[truncated]")
             break
+        out.append(block)
+        used += tokens
+
+    text  = "\n\n".join(out)
+    saved = count_tokens(raw_text) - count_tokens(text)
+    return text, saved
+
+
+def _split_into_chunks(raw_text, max_tokens):
+    """
+    Pack the lecture into chunks of at most `max_tokens` tokens, breaking
+    only between blank-line separated blocks (pages / slides) unless a
+    single block is itself too long.
+    """
+    chunks, current, count = [], [], 0
+    for block in re.split(r'\n\s*\n', raw_text):
+        if not block.strip():
+            continue
+        n = count_tokens(block)
+        if current and count + n > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, count = [], 0
+        if n > max_tokens:
+            words = block.split()
+            step  = max(1, len(words) * max_tokens // n)
+            for k in range(0, len(words), step):
+                chunks.append(" ".join(words[k:k + step]))
+            continue
+        current.append(block)
+        count += n
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _complete_notes(backend, prompt):
+    return _clean_notes(backend.complete(NOTES_MODEL, [{"role": "user", "content": prompt}]))
+
+
+def _stream_completion_lines(backend, prompt, job=None):
+    """Yield the completion's lines as soon as each one is finished."""
+    pending = ""
+    for piece in backend.stream(NOTES_MODEL, [{"role": "user", "content": prompt}]):
+        if job:
+            job.check()
+        pending += piece
+        *done, pending = pending.split("\n")
+        yield from done
+    if pending:
+        yield pending
+
+
+def iter_notes_lines(raw_text, detail=0.5, custom_instructions="", job=None):
+    """
+    Yield the cleaned notes line by line. Short lectures are streamed
+    straight from the completion so rendering can start before GPT has
+    finished; the full notes are cached once the last line is out.
+    A cancelled `job` stops it at the next streamed chunk or chunk summary.
+    """
+    raw_text, saved = compact_lecture_text(raw_text)
+    tokens          = count_tokens(raw_text)
+    print(f"[Notes] prompt text {tokens} tokens ({saved} saved by compaction)")
+
+    cache_key = notes_cache_key(raw_text, detail, custom_instructions)
+    cached    = notes_cache.get(cache_key)
+    if cached is not None:
+        print(f"[Cache] notes hit {cache_key[:12]}")
+        yield from cached.split("\n")
+        return
+
+    bucket  = _detail_bucket(detail)
+    backend = get_llm_backend()
+    lines   = []
+
+    if tokens <= NOTES_CHUNK_TOKENS:
+        prompt = _notes_prompt(raw_text, bucket, custom_instructions)
+        for line in _clean_note_lines(_stream_completion_lines(backend, prompt, job)):
+            lines.append(line)
+            yield line
+    else:
+        # Long lecture: summarise each chunk in parallel and stitch the
+        # results back together in lecture order.
+        chunks  = _split_into_chunks(raw_text, NOTES_CHUNK_TOKENS)
+        prompts = [_notes_prompt(chunk, bucket, custom_instructions, part=k + 1, parts=len(chunks))
+                   for k, chunk in enumerate(chunks)]
+        print(f"[Notes] {tokens} tokens -> {len(chunks)} chunks")
+        pool    = ThreadPoolExecutor(max_workers=min(NOTES_CONCURRENCY, len(chunks)))
+        futures = [pool.submit(_complete_notes, backend, prompt) for prompt in prompts]
+        try:
+            for future in futures:
+                part = job.result(future) if job else future.result()
+                if not part:
+                    continue
+                if lines:
+                    lines.append("")
+                    yield ""
+                for line in part.split("\n"):
+                    lines.append(line)
+                    yield line
+        finally:
+            # Chunks nobody will read again are dropped instead of waited for
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    if lines:
+        notes_cache.set(cache_key, "\n".join(lines))
+
+
+def iter_notes_lines_from_pages(pages, detail=0.5, custom_instructions="", job=None):
+    """
+    iter_notes_lines() for a lecture that is still being extracted, one page
+    text at a time. Pages are batched up to NOTES_CHUNK_TOKENS and each batch
+    is compacted and sent to the LLM as soon as it is full, so early chunks
+    are summarised while later pages are still being read; the parts come
+    out in lecture order. Past NOTES_TOKEN_BUDGET nothing more is sent, but
+    the remaining pages are still read so the extract and notes caches fill
+    under the same keys iter_notes_lines() uses.
+    A lecture that turns out to fit in one chunk is handed to
+    iter_notes_lines() whole, streaming and notes cache included.
+    """
+    bucket, backend = _detail_bucket(detail), get_llm_backend()
+    pool     = ThreadPoolExecutor(max_workers=NOTES_CONCURRENCY)
+    futures  = deque()
+    texts    = []                 # every page, for the notes cache key
+    batch    = []                 # pages not yet sent
+    size     = 0                  # their tokens
+    lines    = []
+    used     = part = 0           # prompt tokens sent so far / chunks submitted
+    sending  = True               # False once NOTES_TOKEN_BUDGET is spent
+
+    def submit(raw):
+        nonlocal used, part, sending
+        text, _ = compact_lecture_text(raw)
+        tokens  = count_tokens(text)
+        if used + tokens > NOTES_TOKEN_BUDGET:
+            text, _ = compact_lecture_text(raw, budget=max(1, NOTES_TOKEN_BUDGET - used))
+            tokens  = count_tokens(text)
+            sending = False
+        used += tokens
+        for chunk in _split_into_chunks(text, NOTES_CHUNK_TOKENS):
+            part += 1
+            prompt = _notes_prompt(chunk, bucket, custom_instructions, part=part)
+            futures.append(pool.submit(_complete_notes, backend, prompt))
+
+    def drain(wait):
+        while futures and (wait or futures[0].done()):
+            future = futures.popleft()
+            text   = job.result(future) if job else future.result()
+            if not text:
+                continue
+            if lines:
+                lines.append("")
+                yield ""
+            for line in text.split("\n"):
+                lines.append(line)
+                yield line
+
+    try:
+        for page in pages:
+            if job:
+                job.check()
+            texts.append(page)
+            tokens = count_tokens(page) if sending else 0
+            if sending and batch and size + tokens > NOTES_CHUNK_TOKENS:
+                submit("\n\n".join(batch))
+                batch, size = [], 0
+            if sending:   # past the budget, pages are only read for the caches
+                batch.append(page)
+                size += tokens
+            yield from drain(wait=False)
+
+        if not part:
+            yield from iter_notes_lines("\n\n".join(texts), detail, custom_instructions, job)
+            return
+        if batch and sending:
+            submit("\n\n".join(batch))
+        print(f"[Notes] {used} tokens -> {part} chunks, sent while the PDF was being read")
+        yield from drain(wait=True)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if lines:
+        raw_text, _ = compact_lecture_text("\n\n".join(texts))
+        notes_cache.set(notes_cache_key(raw_text, detail, custom_instructions), "\n".join(lines))
+
+
+def generate_notes(raw_text, detail=0.5, custom_instructions=""):
+    return "\n".join(iter_notes_lines(raw_text, detail, custom_instructions))
+
+
+# ── METRICS ──────────────────────────────────────────────────────────────────
+
+STAGE_BUCKETS  = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MEMORY_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class Metrics:
+    """
+    Process-wide histograms, counters and gauges, rendered for /metrics in
+    the Prometheus text format. Series are keyed by (name, sorted label items).
+    """
+
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._help   = {}   # name -> (type, help)
+        self._bounds = {}   # histogram name -> bucket upper bounds
+        self._hists  = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._counts = {}   # (name, labels) -> value, counters and gauges
+
+    def describe(self, name, kind, help_text, buckets=STAGE_BUCKETS):
+        self._help[name] = (kind, help_text)
+        if kind == "histogram":
+            self._bounds[name] = buckets
+
+    def observe(self, name, value, **labels):
+        key    = (name, tuple(sorted(labels.items())))
+        bounds = self._bounds.get(name, STAGE_BUCKETS)
+        with self._lock:
+            hist = self._hists.setdefault(key, [0] * (len(bounds) + 2))
+            for k, bound in enumerate(bounds):
+                if value <= bound:
+                    hist[k] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counts[key] = value
+
+    def render(self):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+        out = []
+        with self._lock:
+            hists, counts = dict(self._hists), dict(self._counts)
+        for name in sorted({n for n, _ in hists} | {n for n, _ in counts}):
+            kind, help_text = self._help.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for (n, labels), hist in sorted(hists.items()):
+                if n != name:
+                    continue
+                for bound, cum in zip(self._bounds.get(name, STAGE_BUCKETS), hist):
+                    out.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {cum}")
+                out.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist[-1]}")
+                out.append(f"{name}_sum{fmt(labels)} {hist[-2]:.6f}")
+                out.append(f"{name}_count{fmt(labels)} {hist[-1]}")
+            for (n, labels), value in sorted(counts.items()):
+                if n == name:
+                    out.append(f"{name}{fmt(labels)} {value}")
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("handywrite_stage_seconds", "histogram", "Time spent in each pipeline stage per request")
+metrics.describe("handywrite_request_seconds", "histogram", "Request latency by endpoint")
+metrics.describe("handywrite_pages_rendered_total", "counter", "Handwritten pages rasterized")
+metrics.describe("handywrite_bytes_produced_total", "counter", "Bytes of PNG pages and PDFs produced")
+metrics.describe("handywrite_job_peak_rss_megabytes", "histogram", "Peak RSS growth per request by stage",
+                 buckets=MEMORY_BUCKETS)
+metrics.describe("handywrite_jobs_over_budget_total", "counter", "Jobs stopped by JOB_MEMORY_BUDGET_MB")
+metrics.describe("handywrite_jobs_cancelled_total", "counter", "Jobs abandoned before finishing, by reason")
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
 
-    return '\n'.join(lines).strip()
+class MemoryBudgetExceeded(Exception):
+    """A job grew past JOB_MEMORY_BUDGET_MB. Raised between pages so the worker survives."""
+
+
+class MemorySampler:
+    """
+    One background thread that reads RSS every MEMORY_SAMPLE_MS and hands it
+    to every attached PipelineTimer, so short allocation spikes inside a
+    stage (a page being rasterized) are seen, not just stage boundaries.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._timers  = set()
+        self._lock    = threading.Lock()
+        self._thread  = None
+
+    def attach(self, timer):
+        with self._lock:
+            self._timers.add(timer)
+            if self._thread is None and rss_bytes() is not None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+
+    def detach(self, timer):
+        with self._lock:
+            self._timers.discard(timer)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                timers = list(self._timers)
+            if timers:
+                rss = rss_bytes()
+                for timer in timers:
+                    timer.note_rss(rss)
+
+
+memory_sampler = MemorySampler(MEMORY_SAMPLE_MS / 1000)
+
+
+class PipelineTimer:
+    """
+    Stage timings and counts for one request, summed over every time a
+    stage runs. The totals become the Server-Timing header and, once the
+    request ends, one observation per stage in the /metrics histograms.
+    Safe to share between a batch's worker threads.
+
+    Memory is tracked as RSS growth since the job started, with the peak
+    kept per stage. RSS is process-wide, so concurrent jobs see each
+    other's allocations; the budget is a guard against the process
+    running away, not an exact per-job accounting.
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        self.stages    = OrderedDict()   # stage -> seconds
+        self.counts    = OrderedDict()   # name -> total
+        self.mem_peaks = OrderedDict()   # stage -> peak RSS growth in bytes
+        self.mem_peak  = 0
+        self.budget    = (JOB_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb) << 20
+        self.rss_start = rss_bytes()
+        self._active   = {}              # thread id -> stage it is in
+        self._lock     = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        tid = threading.get_ident()
+        with self._lock:
+            outer = self._active.get(tid)
+            self._active[tid] = name
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+            self.note_rss(rss_bytes())
+            with self._lock:
+                if outer is None:
+                    self._active.pop(tid, None)
+                else:
+                    self._active[tid] = outer
+
+    def note_rss(self, rss):
+        if rss is None or self.rss_start is None:
+            return
+        growth = max(0, rss - self.rss_start)
+        with self._lock:
+            self.mem_peak = max(self.mem_peak, growth)
+            for name in set(self._active.values()):
+                self.mem_peaks[name] = max(self.mem_peaks.get(name, 0), growth)
+
+    def check_memory(self):
+        """Raise MemoryBudgetExceeded if the job has grown past its budget."""
+        self.note_rss(rss_bytes())
+        if self.budget and self.mem_peak > self.budget:
+            metrics.inc("handywrite_jobs_over_budget_total")
+            raise MemoryBudgetExceeded(
+                f"Job used {self.mem_peak >> 20} MB, over the {self.budget >> 20} MB memory budget"
+            )
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def timed_iter(self, name, iterable):
+        """
+        Yield from `iterable`, charging the time spent waiting on it to stage
+        `name`. Closing this closes `iterable` too.
+        """
+        it = iter(iterable)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    self.add(name, time.perf_counter() - t0)
+                    return
+                self.add(name, time.perf_counter() - t0)
+                yield item
+        finally:
+            close = getattr(it, "close", None)
+            if close:
+                close()
+
+    def count(self, name, n):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+        if name == "pages":
+            metrics.inc("handywrite_pages_rendered_total", n)
+        elif name.endswith("_bytes"):
+            metrics.inc("handywrite_bytes_produced_total", n, kind=name[:-len("_bytes")])
+
+    def publish(self):
+        with self._lock:
+            stages = list(self.stages.items())
+            peaks  = list(self.mem_peaks.items())
+        for name, secs in stages:
+            metrics.observe("handywrite_stage_seconds", secs, stage=name)
+        for name, peak in peaks:
+            metrics.observe("handywrite_job_peak_rss_megabytes", peak / (1 << 20), stage=name)
+        if self.mem_peak >= 64 << 20:
+            print(f"[Memory] job peak +{self.mem_peak >> 20} MB ("
+                  + ", ".join(f"{name} +{peak >> 20}" for name, peak in peaks) + ")")
+
+    def server_timing(self):
+        with self._lock:
+            parts  = [f"{name};dur={secs * 1000:.1f}" for name, secs in self.stages.items()]
+            parts += [f'{name};desc="{n}"' for name, n in self.counts.items()]
+            parts += [f'mem_{name};desc="+{peak / (1 << 20):.1f}MB"' for name, peak in self.mem_peaks.items()]
+        return ", ".join(parts)
+
+
+# ── JOBS ─────────────────────────────────────────────────────────────────────
+
+class JobCancelled(Exception):
+    """The job's result is no longer wanted. Raised at the next checkpoint so the worker is freed."""
+
+
+class Job:
+    """
+    One /generate or /generate_batch request, as far as cancellation goes.
+    cancel() only sets a flag; the pipeline calls check() between stages,
+    between pages and between LLM chunks, and whatever was in flight at
+    that point (an LLM call, a page) is abandoned rather than finished.
+    """
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.started    = time.monotonic()
+        self.reason     = None
+        self.cancelled  = threading.Event()
+
+    def cancel(self, reason):
+        if self.cancelled.is_set():
+            return
+        self.reason = reason
+        self.cancelled.set()
+        metrics.inc("handywrite_jobs_cancelled_total", reason=reason)
+        print(f"[Job] Session {(self.session_id or '-')[:8]}: cancelled ({reason})")
+
+    def check(self):
+        """Raise JobCancelled if the job has been cancelled."""
+        if self.cancelled.is_set():
+            raise JobCancelled(self.reason)
+
+    def sleep(self, seconds):
+        """time.sleep() that wakes up, and raises, as soon as the job is cancelled."""
+        self.cancelled.wait(seconds)
+        self.check()
+
+    def result(self, future, poll=0.1):
+        """future.result(), checking for cancellation while it waits."""
+        while True:
+            try:
+                return future.result(timeout=poll)
+            except FutureTimeout:
+                self.check()
+
+    @property
+    def current(self):
+        """False once a newer job for the same session has taken over."""
+        return not self.session_id or active_jobs.get(self.session_id) is self
+
+
+active_jobs = {}          # session_id -> its running Job
+_jobs_lock  = threading.Lock()
+
+def start_job(session_id):
+    """Register a new job for the session. A job it still had running is cancelled: a re-submission."""
+    job = Job(session_id)
+    if session_id:
+        with _jobs_lock:
+            previous, active_jobs[session_id] = active_jobs.get(session_id), job
+        if previous:
+            previous.cancel("superseded")
+    return job
+
+def finish_job(job):
+    with _jobs_lock:
+        if job.session_id and active_jobs.get(job.session_id) is job:
+            del active_jobs[job.session_id]
+
+def cancel_job(session_id, reason, before=None):
+    """Cancel the session's running job (only if it started before `before`, when given)."""
+    with _jobs_lock:
+        job = active_jobs.get(session_id)
+    if not job or (before is not None and job.started > before):
+        return False
+    job.cancel(reason)
+    return True
+
+
+# /progress doubles as the disconnect detector: a browser tab keeps one
+# EventSource open (reconnecting within a second when it ends), so a session
+# with no stream for DISCONNECT_GRACE_S has gone away. Clients that never
+# open /progress are never cancelled this way.
+_progress_streams = {}    # session_id -> open /progress streams
+
+def progress_stream_opened(session_id):
+    with _jobs_lock:
+        _progress_streams[session_id] = _progress_streams.get(session_id, 0) + 1
+
+def progress_stream_closed(session_id):
+    with _jobs_lock:
+        left = _progress_streams[session_id] = _progress_streams.get(session_id, 1) - 1
+        if not left:
+            del _progress_streams[session_id]
+    if not left:
+        timer = threading.Timer(DISCONNECT_GRACE_S, _check_disconnect, (session_id, time.monotonic()))
+        timer.daemon = True
+        timer.start()
+
+def _check_disconnect(session_id, closed_at):
+    if session_id not in _progress_streams:
+        cancel_job(session_id, "disconnected", before=closed_at)
+
+
+# ── PIPELINE ─────────────────────────────────────────────────────────────────
+
+def run_pipeline(source, filename, custom_instructions="", detail=0.5, messiness=0.3,
+                 on_stage=None, timer=None, render_mode=None, job=None):
+    """
+    Upload (bytes or spooled file path) -> base64 PNG pages. `on_stage(step, msg, **extra)` is
+    told when each stage starts, using the same step numbers as /progress, and again for every
+    page while rendering (extra: page, pages, eta); stage timings go to `timer`.
+    `render_mode` is one of RENDER_MODES (default RENDER_MODE). If `job` is cancelled,
+    JobCancelled is raised at the next stage, page or LLM chunk.
+    """
+    on_stage = on_stage or (lambda step, msg, **extra: None)
+    timer    = timer or PipelineTimer()
+    job      = job or Job()
+
+    job.check()
+    on_stage(0, "Extracting content...")
+    with timer.stage("extract"):
+        extracted = extract_from_upload(source, filename, stream_pages=True)
+    timer.check_memory()
+
+    job.check()
+    on_stage(1, "Generating with LLM...")
+    # Pages are laid out and rasterized while GPT is still writing later sections;
+    # "llm" is only the time spent waiting on the next line of notes
+    if isinstance(extracted, str):
+        notes_lines = iter_notes_lines(extracted, detail=detail, custom_instructions=custom_instructions,
+                                       job=job)
+    else:
+        # A large PDF: its first chunks go to the LLM while later pages are still being read
+        notes_lines = iter_notes_lines_from_pages(timer.timed_iter("extract", extracted), detail=detail,
+                                                  custom_instructions=custom_instructions, job=job)
+    pages_b64   = []
+
+    def on_page(page, total, eta):
+        msg = f"Rendering page {page} of {total}..." if total else f"Rendering page {page}..."
+        on_stage(2, msg, page=page, pages=total, eta=None if eta is None else round(eta, 1))
+
+    for img in render_notes_stream(timer.timed_iter("llm", notes_lines), messiness=messiness,
+                                   timer=timer, mode=render_mode, on_page=on_page, job=job):
+        job.check()   # don't encode a page nobody will read
+        with timer.stage("encode"):
+            pages_b64.append(encode_page(img))
+        timer.count("png_bytes", len(pages_b64[-1]) * 3 // 4)
+        del img
+        # Between pages is the safe place to stop: nothing half-built is left behind
+        timer.check_memory()
+    return pages_b64
+
+
+# ── WARM-UP ──────────────────────────────────────────────────────────────────
+
+COMMON_GLYPHS = "".join(sorted(set(map(chr, range(33, 127))) | set(
+    "αβγδεζηθικλμνξοπρστυφχψωΑΒΓΔΕΖΗΘΙΚΛΜΝΞΟΠΡΣΤΥΦΧΨΩ"   # Greek
+    "±×÷≈≠≤≥∞∑∏∫∂√∆°′″¢£¥€©®™¡¿«»‹›“”‘’–—†‡§¶•·"       # maths, currency, punctuation
+)))
+WARM_UP_SIZES = sorted({FONT_SIZE, FONT_SIZE - 2, SUB_SIZE, HEADING_SIZE})   # every size PageLayout uses
+
+warm_up_done  = threading.Event()
+warm_up_state = {"error": None, "seconds": None}
+
+def warm_up():
+    """
+    Load and check both fonts, pre-rasterize the common glyphs at the layout
+    sizes and render one small page, so the first real request doesn't pay
+    for it. A missing font is reported here (and keeps /ready at 503) rather
+    than silently rendering with ImageFont.load_default().
+    """
+    t0 = time.perf_counter()
+    try:
+        missing = [path for path in (FONT_PATH, FONT_FALLBACK) if load_font(path, FONT_SIZE) is None]
+        if missing:
+            raise RuntimeError("Cannot load font " + ", ".join(missing))
+        for size in WARM_UP_SIZES:
+            # Mapped from disk when another worker (or an earlier boot) already built it
+            if glyph_atlas(size, build_chars=COMMON_GLYPHS) is None:
+                for char in COMMON_GLYPHS:
+                    glyph(char, size)
+        render_page(["# Warm-up", "## Section", "- bullet with αβγ and √x ≤ 2", "  - sub bullet"])
+    except Exception as e:
+        warm_up_state["error"] = str(e)
+        print(f"[WarmUp] FAILED: {e}")
+    warm_up_state["seconds"] = time.perf_counter() - t0
+    STARTUP_TIMES["warm-up"] = warm_up_state["seconds"]
+    metrics.set("handywrite_startup_seconds", warm_up_state["seconds"], phase="warm-up")
+    if not warm_up_state["error"]:
+        mapped = sum(len(a) for a in _atlases.values() if a)
+        print(f"[WarmUp] {mapped} atlas + {len(_glyph_cache)} in-process glyphs at sizes {WARM_UP_SIZES} "
+              f"ready in {warm_up_state['seconds'] * 1000:.0f} ms")
+    warm_up_done.set()
 
 
 # ── FLASK APP ─────────────────────────────────────────────────────────────────
 
+class UploadRequest(Request):
+    """Spools file parts larger than UPLOAD_SPOOL_MB to a named temp file instead of memory."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_MB << 20:
+            return io.BytesIO()
+        return tempfile.NamedTemporaryFile("w+b", prefix="upload-", suffix=".part")
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    pass
+
+
+def upload_source(uploaded):
+    """
+    What the extractors should read: the spooled file's path for big uploads
+    (PyMuPDF and zipfile open it directly), bytes for small ones. Uploads
+    over MAX_UPLOAD_MB are rejected.
+    """
+    stream = uploaded.stream
+    path   = getattr(stream, "name", None)
+    if isinstance(path, str) and os.path.exists(path):
+        stream.flush()
+        size = os.path.getsize(path)
+        if size > MAX_UPLOAD_MB << 20:
+            raise UploadTooLarge(f"{uploaded.filename} is larger than {MAX_UPLOAD_MB} MB")
+        return path
+    data = uploaded.read()
+    if len(data) > MAX_UPLOAD_MB << 20:
+        raise UploadTooLarge(f"{uploaded.filename} is larger than {MAX_UPLOAD_MB} MB")
+    return data
+
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(32))
+app.request_class = UploadRequest
+# Checked against Content-Length before the body is read, and again while streaming it
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB << 20
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    g.timer   = PipelineTimer()
+    memory_sampler.attach(g.timer)
+
+@app.teardown_request
+def stop_timer(exc):
+    if "timer" in g:
+        memory_sampler.detach(g.timer)
+    if "job" in g:
+        finish_job(g.job)
+
+@app.after_request
+def report_timings(response):
+    timer = g.get("timer")
+    if timer is not None and timer.stages:
+        response.headers["Server-Timing"] = timer.server_timing()
+        timer.publish()
+    if "started" in g and request.endpoint:
+        metrics.observe("handywrite_request_seconds", time.perf_counter() - g.started,
+                        endpoint=request.endpoint)
+    return response
+
+@app.errorhandler(MemoryBudgetExceeded)
+def over_budget(e):
+    print(f"[Memory] {e}")
+    return jsonify({"error": "The server ran short of memory for this file. Try again shortly "
+                             "or upload a smaller file."}), 503
+
+@app.errorhandler(JobCancelled)
+def cancelled(e):
+    # Usually nobody is listening any more; a superseded tab still gets a clear answer
+    return jsonify({"error": "Cancelled", "cancelled": True, "reason": str(e)}), 409
+
+@app.errorhandler(RequestEntityTooLarge)
+def too_large(e):
+    limit = request.max_content_length or MAX_UPLOAD_MB << 20   # a route may raise the app-wide cap
+    msg   = e.description if isinstance(e, UploadTooLarge) else f"Upload is larger than {limit >> 20} MB"
+    return jsonify({"error": msg}), 413
 
 # Store progress per session ID
 progress_store = {}
 
-def set_progress(step, msg):
-    """Update progress for the current session"""
-    session_id = session.get('session_id')
+def set_progress(step, msg, session_id=None, **extra):
+    """Update progress for a session (the current request's unless one is given)"""
+    if session_id is None and has_request_context():
+        session_id = session.get('session_id')
     if session_id:
-        progress_store[session_id] = {"step": step, "msg": msg}
+        progress_store[session_id] = {"step": step, "msg": msg, **extra}
         print(f"[Progress] Session {session_id[:8]}: step={step}, msg={msg}")  # Debug log
 
+def clear_progress():
+    """Reset the request's progress, unless a newer job for the session already owns it."""
+    job = g.get("job")
+    if job is None or job.current:
+        set_progress(-1, "", job.session_id if job else None)
+
 HTML = """<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -864,6 +2787,13 @@ HTML = """<!DOCTYPE html>
     outline: none;
   }
 
+  .instructions-wrap .draft-toggle {
+    margin: 10px 0 0;
+    cursor: pointer;
+  }
+
+  .instructions-wrap .draft-toggle input { accent-color: var(--gold); }
+
   .instructions-wrap textarea:focus {
     border-color: rgba(74,127,212,0.5);
     box-shadow: 0 0 0 3px rgba(74,127,212,0.08);
@@ -1378,6 +3308,11 @@ HTML = """<!DOCTYPE html>
       <span class="tag">optional</span>
     </label>
     <textarea id="instructions" rows="3" placeholder="e.g. focus on definitions only, skip all the math, write as if explaining to a beginner, use lots of examples..."></textarea>
+    <label class="draft-toggle">
+      <input type="checkbox" id="draftMode">
+      Quick draft
+      <span class="tag">plain, fast preview of the layout</span>
+    </label>
   </div>
 
   <!-- Button -->
@@ -1451,6 +3386,7 @@ HTML = """<!DOCTYPE html>
   const fileNameDisplay = document.getElementById('fileNameDisplay');
   const generateBtn     = document.getElementById('generateBtn');
   const instructions    = document.getElementById('instructions');
+  const draftMode       = document.getElementById('draftMode');
   const status          = document.getElementById('status');
   const progressWrap    = document.getElementById('progressWrap');
   const progressBar     = document.getElementById('progressBar');
@@ -1463,8 +3399,12 @@ HTML = """<!DOCTYPE html>
   // step → % width:  0=extract(15%), 1=AI(50%), 2=render(80%), done(100%)
   const STAGE_PROGRESS = { extracting: 15, generating: 50, rendering: 80, done: 100 };
 
-  function setProgress(stage) {
-    const pct = STAGE_PROGRESS[stage] ?? 0;
+  // While rendering, the bar moves from 'generating' towards 'done' page by page
+  function setProgress(stage, fraction) {
+    let pct = STAGE_PROGRESS[stage] ?? 0;
+    if (stage === 'rendering' && fraction != null) {
+      pct = STAGE_PROGRESS.generating + (STAGE_PROGRESS.done - 2 - STAGE_PROGRESS.generating) * fraction;
+    }
     if (pct > 0) {
       progressWrap.classList.add('visible');
       progressBar.style.width = pct + '%';
@@ -1508,14 +3448,22 @@ HTML = """<!DOCTYPE html>
     status.className = 'status' + (isError ? ' error' : '');
   }
 
-  function setBtnStage(stage) {
+  function setBtnStage(stage, detail) {
     const stages = {
       extracting: '<span class="spinner"></span> Reading lecture...',
       generating: '<span class="spinner"></span> Generating notes with AI...',
       rendering:  '<span class="spinner"></span> Rendering handwriting...',
       done:       '<span class="btn-icon">✍️</span> Generate Handwritten Notes',
     };
-    generateBtn.innerHTML = stages[stage] || stages.done;
+    generateBtn.innerHTML = detail ? '<span class="spinner"></span> ' + detail : (stages[stage] || stages.done);
+  }
+
+  // "Rendering page 3 of 8 · ~12s left" from a step-2 progress event
+  function renderingDetail(d) {
+    if (!d.page) return null;
+    let text = 'Rendering page ' + d.page + (d.pages ? ' of ' + d.pages : '');
+    if (d.eta != null) text += ' · ~' + Math.max(1, Math.round(d.eta)) + 's left';
+    return text;
   }
 
   generateBtn.addEventListener('click', async () => {
@@ -1532,10 +3480,12 @@ HTML = """<!DOCTYPE html>
       const formData = new FormData();
       formData.append('pdf', selectedFile);
       formData.append('instructions', instructions.value.trim());
+      if (draftMode.checked) formData.append('render_mode', 'draft');
 
       const res  = await fetch('/generate', { method: 'POST', body: formData });
       const data = await res.json();
 
+      if (data.cancelled) throw new Error('Generation was cancelled (' + data.reason + ')');
       if (!res.ok || data.error) throw new Error(data.error || 'Server error');
 
       setProgress('done');
@@ -1652,21 +3602,63 @@ HTML = """<!DOCTYPE html>
       const d = JSON.parse(e.data);
       if (d.step === 0) { setBtnStage('extracting'); setProgress('extracting'); }
       else if (d.step === 1) { setBtnStage('generating'); setProgress('generating'); }
-      else if (d.step === 2) { setBtnStage('rendering');  setProgress('rendering'); }
+      else if (d.step === 2) {
+        setBtnStage('rendering', renderingDetail(d));
+        setProgress('rendering', d.pages ? (d.page - 1) / d.pages : null);
+      }
     };
   }
   
   startProgressListener();
+
+  // Leaving the page mid-generation cancels the job instead of letting it finish for nobody
+  window.addEventListener('pagehide', () => {
+    if (!isGenerating || !SESSION_ID) return;
+    const body = new FormData();
+    body.append('session_id', SESSION_ID);
+    navigator.sendBeacon('/cancel', body);
+  });
 </script>
 </body>
 </html>"""
 
+def _build_index_page():
+    """
+    The landing page never changes while the process runs (HTML has no template
+    variables), so it is encoded and compressed once. Each encoding gets its
+    own strong ETag, as the bytes differ.
+    """
+    body     = HTML.encode("utf-8")
+    variants = {"identity": body, "gzip": gzip.compress(body, 9)}
+    try:
+        import brotli
+        variants["br"] = brotli.compress(body, quality=11)
+    except ImportError:
+        pass
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return {enc: (data, f"{digest}-{enc}") for enc, data in variants.items()}
+
+INDEX_PAGE = _build_index_page()
+
 @app.route("/")
 def index():
     # Create a unique session ID for each user
     if 'session_id' not in session:
         session['session_id'] = secrets.token_hex(16)
-    return render_template_string(HTML)
+
+    encoding = next((enc for enc in ("br", "gzip")
+                     if enc in INDEX_PAGE and request.accept_encodings[enc]), "identity")
+    body, etag = INDEX_PAGE[encoding]
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(body, mimetype="text/html")
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    resp.headers["Vary"]          = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "no-cache"   # always revalidate; unchanged pages come back as 304
+    return resp
 
 @app.route("/get_session")
 def get_session():
@@ -1675,24 +3667,42 @@ def get_session():
         session['session_id'] = secrets.token_hex(16)
     return jsonify({"session_id": session['session_id']})
 
+@app.route("/cancel", methods=["POST"])
+def cancel():
+    """
+    Abandon the session's running job. The session comes from the cookie, or a
+    "session_id" form/JSON field (the page sends this with navigator.sendBeacon
+    when it is closed mid-generation).
+    """
+    data       = request.get_json(silent=True) or {}
+    session_id = session.get('session_id') or request.form.get('session_id') or data.get('session_id')
+    if not session_id:
+        return jsonify({"error": "No session"}), 400
+    return jsonify({"cancelled": cancel_job(session_id, "user")})
+
 @app.route("/progress")
 def progress():
     # Capture session_id BEFORE entering the generator (while request context is active)
     session_id = request.args.get('session_id')
     
     def stream():
-        import json, time
         if not session_id:
             return
         
-        last = None
-        for _ in range(600):  # Increased iterations
-            cur = progress_store.get(session_id, {"step": -1, "msg": ""})
-            if cur != last and cur.get("step", -1) >= 0:
-                yield f"data: {json.dumps(cur)}\n\n"
-                last = dict(cur)
-            time.sleep(0.1)  # Faster polling - 100ms instead of 300ms
-    from flask import Response
+        progress_stream_opened(session_id)
+        try:
+            yield "retry: 1000\n\n"   # reconnect quickly, well inside DISCONNECT_GRACE_S
+            last = None
+            for i in range(600):  # Increased iterations
+                cur = progress_store.get(session_id, {"step": -1, "msg": ""})
+                if cur != last and cur.get("step", -1) >= 0:
+                    yield f"data: {json.dumps(cur)}\n\n"
+                    last = dict(cur)
+                elif i % 20 == 0:
+                    yield ": ping\n\n"   # a write to a closed tab is how a disconnect shows up
+                time.sleep(0.1)  # Faster polling - 100ms instead of 300ms
+        finally:
+            progress_stream_closed(session_id)
     return Response(stream(), mimetype="text/event-stream", headers={
         'Cache-Control': 'no-cache',
         'X-Accel-Buffering': 'no'
@@ -1702,24 +3712,32 @@ def progress():
 def download():
     data      = request.get_json()
     pages_b64 = data.get("pages", [])
-    images    = []
+    if not pages_b64:
+        return jsonify({"error": "No pages to download"}), 400
+    # One page is decoded at a time and goes into the PDF as a JPEG, so memory
+    # stays flat however many pages the notebook has
+    doc = lazy_import("fitz").open()
     for b64 in pages_b64:
-        img_bytes = base64.b64decode(b64)
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        images.append(img)
-    buf = io.BytesIO()
-    if images:
-        images[0].save(buf, format="PDF", save_all=True, append_images=images[1:])
-    buf.seek(0)
-    from flask import send_file
+        with g.timer.stage("decode"):
+            with Image.open(io.BytesIO(base64.b64decode(b64))) as img:
+                size = img.size
+                jpg  = io.BytesIO()
+                img.convert("RGB").save(jpg, format="JPEG")
+        with g.timer.stage("pdf"):
+            page = doc.new_page(width=size[0], height=size[1])
+            page.insert_image(page.rect, stream=jpg.getvalue())
+    with g.timer.stage("pdf"):
+        buf = io.BytesIO(doc.tobytes(garbage=1, deflate=True))
+        doc.close()
+    g.timer.count("pdf_bytes", len(buf.getbuffer()))
     return send_file(buf, mimetype="application/pdf",
                      as_attachment=True, download_name="handwritten_notes.pdf")
 
 @app.route("/generate", methods=["POST"])
 def generate():
     try:
-        import time
-        uploaded = request.files.get("pdf")
+        with g.timer.stage("upload"):
+            uploaded = request.files.get("pdf")
         if not uploaded:
             return jsonify({"error": "No file uploaded"}), 400
 
@@ -1727,35 +3745,152 @@ def generate():
         detail       = 0.5
         filename     = uploaded.filename or "upload.pdf"
         custom_instr = request.form.get("instructions", "").strip()
-
-        set_progress(0, "Extracting content...")
-        time.sleep(0.5)  # Increased delay for visibility
-        file_bytes = uploaded.read()
-        raw_text   = extract_from_upload(file_bytes, filename)
-
-        set_progress(1, "Generating with LLM...")
-        time.sleep(0.5)  # Increased delay for visibility
-        notes = generate_notes(raw_text, detail=detail, custom_instructions=custom_instr)
-
-        set_progress(2, "Rendering handwritten pages...")
-        time.sleep(0.5)  # Increased delay for visibility
-        pages_b64 = render_notes_to_b64(notes, messiness=messiness)
+        render_mode  = request.form.get("render_mode") or None
+        session_id   = session.get('session_id')
+        if render_mode not in (None,) + RENDER_MODES:
+            return jsonify({"error": f"Unknown render_mode {render_mode!r}"}), 400
+        job = g.job = start_job(session_id)
+
+        def on_stage(step, msg, **extra):
+            job.check()
+            set_progress(step, msg, session_id, **extra)
+            if step < 2:
+                job.sleep(0.5)  # Increased delay for visibility
+
+        with g.timer.stage("upload"):
+            source = upload_source(uploaded)
+        pages_b64 = run_pipeline(source, filename, custom_instr, detail=detail, messiness=messiness,
+                                 on_stage=on_stage, timer=g.timer, render_mode=render_mode, job=job)
 
         set_progress(3, "Done!")
         result = jsonify({"pages": pages_b64})
         time.sleep(0.3)
-        set_progress(-1, "")
+        clear_progress()
         return result
 
+    except (RequestEntityTooLarge, MemoryBudgetExceeded, JobCancelled):
+        clear_progress()
+        raise
     except Exception as e:
         traceback.print_exc()
-        set_progress(-1, "")
+        clear_progress()
         return jsonify({"error": str(e)}), 500
 
+@app.route("/generate_batch", methods=["POST"])
+def generate_batch():
+    """
+    Several uploads in one request (form field "files", repeated). Each file
+    runs through the pipeline on its own worker, BATCH_CONCURRENCY at a
+    time, and renders as soon as its own notes are ready. With combine=1
+    the result is one notebook (pages in upload order), otherwise one
+    document per file. Per-file status is published on /progress as "files".
+    """
+    # A batch may carry up to BATCH_MAX_FILES full-size uploads
+    request.max_content_length = (MAX_UPLOAD_MB * BATCH_MAX_FILES) << 20
+    with g.timer.stage("upload"):
+        uploads = [f for f in request.files.getlist("files") if f and f.filename]
+    if not uploads:
+        return jsonify({"error": "No files uploaded"}), 400
+    if len(uploads) > BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files (max {BATCH_MAX_FILES})"}), 400
+
+    messiness    = 0.3
+    detail       = 0.5
+    custom_instr = request.form.get("instructions", "").strip()
+    combine      = request.form.get("combine", "") in ("1", "true", "on")
+    render_mode  = request.form.get("render_mode") or None
+    session_id   = session.get('session_id')
+    if render_mode not in (None,) + RENDER_MODES:
+        return jsonify({"error": f"Unknown render_mode {render_mode!r}"}), 400
+
+    # Resolve every upload while the request is still open; workers never touch `request`
+    with g.timer.stage("upload"):
+        files = [(f.filename, upload_source(f)) for f in uploads]
+    status = [{"name": name, "step": -1, "msg": "Queued", "pages": 0} for name, _ in files]
+    lock   = threading.Lock()
+    job    = g.job = start_job(session_id)
+
+    def publish():
+        if not job.current:
+            return
+        done = sum(1 for st in status if st["step"] >= 3)
+        set_progress(max(0, min(st["step"] for st in status)), f"{done} of {len(status)} files done",
+                     session_id, files=[dict(st) for st in status])
+
+    timer = g.timer
+
+    def run_one(idx):
+        name, data = files[idx]
+
+        def on_stage(step, msg, **extra):
+            job.check()
+            with lock:
+                status[idx].update(step=step, msg=msg, **extra)
+                publish()
+
+        try:
+            pages = run_pipeline(data, name, custom_instr, detail=detail, messiness=messiness,
+                                 on_stage=on_stage, timer=timer, render_mode=render_mode, job=job)
+            with lock:
+                status[idx].update(step=3, msg="Done", pages=len(pages))
+                publish()
+            return {"filename": name, "pages": pages}
+        except JobCancelled:
+            with lock:
+                status[idx].update(step=3, msg="Cancelled")
+            return {"filename": name, "pages": [], "error": "Cancelled"}
+        except Exception as e:
+            traceback.print_exc()
+            with lock:
+                status[idx].update(step=3, msg=f"Error: {e}")
+                publish()
+            return {"filename": name, "pages": [], "error": str(e)}
+
+    with lock:
+        publish()
+    with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(files))) as pool:
+        documents = list(pool.map(run_one, range(len(files))))
+    clear_progress()
+    job.check()
+
+    if not combine:
+        return jsonify({"documents": documents})
+    pages, index = [], []
+    for doc in documents:
+        index.append({"filename": doc["filename"], "start": len(pages),
+                      "count": len(doc["pages"]), **({"error": doc["error"]} if "error" in doc else {})})
+        pages.extend(doc["pages"])
+    return jsonify({"pages": pages, "documents": index})
+
+@app.route("/ready")
+def ready():
+    """Readiness probe: 503 until warm-up has finished, and for good if it failed."""
+    if not warm_up_done.is_set():
+        return jsonify({"ready": False, "status": "warming up"}), 503
+    if warm_up_state["error"]:
+        return jsonify({"ready": False, "status": "warm-up failed", "error": warm_up_state["error"]}), 503
+    return jsonify({"ready": True, "warm_up_ms": round((warm_up_state["seconds"] or 0) * 1000)})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+STARTUP_TIMES["setup"] = time.perf_counter() - _IMPORTS_DONE
+metrics.describe("handywrite_startup_seconds", "gauge", "Time spent importing, setting up and warming up the app, by phase")
+for _phase, _secs in STARTUP_TIMES.items():   # lazy imports and warm-up are set when they happen
+    metrics.set("handywrite_startup_seconds", _secs, phase=_phase)
+if multiprocessing.parent_process() is None:   # PDF pool workers import this module too
+    print("[Startup] " + ", ".join(f"{phase} {secs * 1000:.0f} ms" for phase, secs in STARTUP_TIMES.items())
+          + f", total {(time.perf_counter() - _BOOT_T0) * 1000:.0f} ms")
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        warm_up_done.set()
+
 if __name__ == "__main__":
     print("Starting server at http://localhost:5000")
     print(f"Font: {FONT_PATH}")
-    if OPENAI_API_KEY == "YOUR_API_KEY_HERE":
+    if LLM_BACKEND == "openai" and OPENAI_API_KEY == "YOUR_API_KEY_HERE":
         print("WARNING: Set your OpenAI API key in app.py or via OPENAI_API_KEY env var")
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("RAILWAY_ENVIRONMENT") is None
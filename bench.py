@@ -0,0 +1,227 @@
+"""
+Rendering micro-benchmarks
+---------------------------
+Run: python bench.py                  compare against bench_baseline.json
+     python bench.py --save           record a new baseline
+     python bench.py --only wrap_text --repeat 10
+
+Times the rendering hot path (render_char, measure_text_width, wrap_text,
+render_page in glyph, word, warp and draft mode, render_notes_to_b64) on
+fixed, seeded note fixtures and reports median time, Python heap peak
+(tracemalloc) and RSS growth per case. Exits 1 if any case is slower
+than the baseline by more than --threshold.
+"""
+
+import argparse, json, os, random, statistics, sys, threading, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+os.environ.setdefault("WARM_UP", "0")   # a background warm-up would skew timings and the seeded RNG
+
+import app
+from PIL import Image
+
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+
+WORDS = ("cell membrane protein enzyme reaction energy transport gradient signal "
+         "receptor pathway binding structure function process molecule rate "
+         "equilibrium pressure volume temperature").split()
+GREEK = "αβγδεθλμπσφω∑∫√∆≈≠≤≥±×÷°"
+
+
+# ── FIXTURES ─────────────────────────────────────────────────────────────────
+
+def _sentence(rng, n_min, n_max, extra=""):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(n_min, n_max))]
+    if extra:
+        for _ in range(len(words) // 3):
+            k = rng.randrange(len(words))
+            words[k] = f"{rng.choice(extra)}={rng.randint(0, 99)}{rng.choice(extra)}"
+    return " ".join(words)
+
+def make_notes(kind, seed=1234):
+    """Deterministic notes text in the #/##/- format generate_notes produces."""
+    rng   = random.Random(seed)
+    extra = GREEK if kind == "greek" else ""
+    sections, bullets, subs = {
+        "short":  (2, 3, 0.0),
+        "long":   (12, 6, 0.2),
+        "nested": (6, 4, 1.0),
+        "greek":  (4, 5, 0.3),
+    }[kind]
+    out = ["# " + _sentence(rng, 2, 4).title()]
+    for _ in range(sections):
+        out.append("## " + _sentence(rng, 2, 5, extra).title())
+        for _ in range(bullets):
+            out.append("- " + _sentence(rng, 6, 18, extra))
+            if rng.random() < subs:
+                for _ in range(rng.randint(1, 3)):
+                    out.append("  - " + _sentence(rng, 4, 12, extra))
+        if rng.random() < 0.5:
+            out.append(_sentence(rng, 12, 30, extra))
+        out.append("")
+    return "\n".join(out).strip()
+
+FIXTURES = {kind: make_notes(kind) for kind in ("short", "long", "nested", "greek")}
+
+
+# ── CASES ────────────────────────────────────────────────────────────────────
+
+def case_render_char(kind):
+    chars  = [c for c in FIXTURES[kind] if not c.isspace()][:400]
+    canvas = Image.new("RGBA", (app.PAGE_W, app.PAGE_H), (0, 0, 0, 0))
+    def run():
+        x = app.MARGIN_LEFT
+        for c in chars:
+            x += app.render_char(canvas, c, x % 1800 + app.MARGIN_LEFT, 600, app.FONT_SIZE)
+    return run
+
+def case_measure_text_width(kind):
+    lines = [l.lstrip("#- ") for l in FIXTURES[kind].split("\n") if l.strip()]
+    return lambda: [app.measure_text_width(l, app.FONT_SIZE) for l in lines]
+
+def case_wrap_text(kind):
+    lines = [l.lstrip("#- ") for l in FIXTURES[kind].split("\n") if l.strip()]
+    x     = app.MARGIN_LEFT + 30
+    return lambda: [app.wrap_text(l, x, app.FONT_SIZE, app.MARGIN_RIGHT - 20) for l in lines]
+
+def case_render_page(kind):
+    lines = FIXTURES[kind].split("\n")
+    return lambda: app.render_page(lines, *app._messiness_params(0.3))
+
+def case_render_page_word(kind):
+    lines = FIXTURES[kind].split("\n")
+    return lambda: app.render_page(lines, *app._messiness_params(0.3), mode="word")
+
+def case_render_page_warp(kind):
+    lines = FIXTURES[kind].split("\n")
+    return lambda: app.render_page(lines, *app._messiness_params(0.3), mode="warp")
+
+def case_render_page_draft(kind):
+    lines = FIXTURES[kind].split("\n")
+    return lambda: app.render_page(lines, mode="draft")
+
+def case_render_notes_to_b64(kind):
+    return lambda: app.render_notes_to_b64(FIXTURES[kind], messiness=0.3)
+
+CASES = [
+    ("render_char",          case_render_char,          ("short", "greek")),
+    ("measure_text_width",   case_measure_text_width,   ("long", "greek")),
+    ("wrap_text",            case_wrap_text,            ("long", "nested", "greek")),
+    ("render_page",          case_render_page,          ("short", "nested", "greek")),
+    ("render_page_word",     case_render_page_word,     ("short", "greek")),
+    ("render_page_warp",     case_render_page_warp,     ("short", "greek")),
+    ("render_page_draft",    case_render_page_draft,    ("short", "greek")),
+    ("render_notes_to_b64",  case_render_notes_to_b64,  ("short", "long", "greek")),
+]
+
+
+# ── MEASUREMENT ──────────────────────────────────────────────────────────────
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+class RSSPeak:
+    """Samples RSS in the background; PIL image buffers don't show up in tracemalloc."""
+
+    def __enter__(self):
+        self.start = self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def _note(self):
+        rss = _rss_bytes()
+        if rss is not None:   # a failed read mid-run is just a missed sample
+            self.peak = max(self.peak, rss)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self._note()
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.start is not None:
+            self._thread.join()
+            self._note()
+
+    @property
+    def growth(self):
+        return None if self.start is None else self.peak - self.start
+
+def measure(make_run, repeat):
+    random.seed(0)
+    run = make_run()
+    run()                                  # warm up caches / lazy imports
+    times = []
+    for _ in range(repeat):
+        random.seed(0)
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+
+    random.seed(0)
+    with RSSPeak() as rss:
+        tracemalloc.start()
+        run()
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms":    min(times) * 1000,
+        "py_peak_kb": py_peak // 1024,
+        "rss_growth_kb": rss.growth // 1024 if rss.growth is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run only cases whose name contains this")
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="allowed slowdown vs baseline before failing (default 0.15 = 15%%)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH) and not args.save:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)["results"]
+
+    results, regressions = {}, []
+    print(f"{'case':<34}{'median ms':>11}{'min ms':>10}{'py peak KB':>12}{'rss +KB':>10}{'vs base':>10}")
+    for name, make_case, kinds in CASES:
+        if args.only and args.only not in name:
+            continue
+        for kind in kinds:
+            key = f"{name}[{kind}]"
+            r   = measure(lambda: make_case(kind), args.repeat)
+            results[key] = r
+            delta = ""
+            if key in baseline:
+                ratio = r["median_ms"] / baseline[key]["median_ms"] - 1
+                delta = f"{ratio:+.0%}"
+                if ratio > args.threshold:
+                    regressions.append(key)
+                    delta += " !"
+            rss = "-" if r["rss_growth_kb"] is None else r["rss_growth_kb"]
+            print(f"{key:<34}{r['median_ms']:>11.1f}{r['min_ms']:>10.1f}{r['py_peak_kb']:>12}{rss:>10}{delta:>10}")
+
+    if args.save:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"python": sys.version.split()[0], "repeat": args.repeat, "results": results},
+                      f, indent=2, sort_keys=True)
+        print(f"Baseline written to {os.path.basename(BASELINE_PATH)}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+End-to-end load test
+---------------------
+Run: python loadtest.py --users 4 --duration 60
+     python loadtest.py --users 8 --latency 1.5 --tokens-per-sec 40 --json report.json
+
+Starts mock_openai on a free port, boots the app against it in a
+subprocess and has N concurrent virtual users upload the sample PDF,
+PPTX and image fixtures. Each user opens /progress, POSTs /generate,
+then POSTs /download with the returned pages. The report covers
+throughput and p50/p95/p99 latency per endpoint, a per-stage breakdown
+taken from the /progress step timestamps, the server's own stage timings
+from the Server-Timing header, and the server's RSS over time.
+"""
+
+import argparse, http.cookiejar, io, json, os, socket, subprocess, sys, tempfile, threading, time, uuid
+import urllib.error, urllib.request, zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+SERVER_WARM_UP = os.environ.get("WARM_UP", "1")   # mock_openai turns warm-up off for this process, not the server
+
+import mock_openai
+
+
+# ── FIXTURES ─────────────────────────────────────────────────────────────────
+
+LECTURE = [
+    ("Cell Structure", ["Prokaryotes lack a nucleus and membrane-bound organelles",
+                        "Eukaryotes compartmentalise reactions in organelles",
+                        "The plasma membrane is a phospholipid bilayer with embedded proteins"]),
+    ("Membrane Transport", ["Diffusion moves solutes down their concentration gradient",
+                            "Facilitated diffusion uses channel and carrier proteins",
+                            "Active transport uses ATP to move solutes against the gradient"]),
+    ("Cellular Respiration", ["Glycolysis splits glucose into two pyruvate in the cytosol",
+                              "The Krebs cycle runs in the mitochondrial matrix",
+                              "Oxidative phosphorylation produces most of the ATP"]),
+]
+
+def make_pdf(pages=6):
+    import fitz
+    doc = fitz.open()
+    for k in range(pages):
+        title, points = LECTURE[k % len(LECTURE)]
+        page = doc.new_page()
+        page.insert_text((72, 72), f"BIO 101 - Lecture 3\n\n{title}\n\n" + "\n".join(points), fontsize=13)
+        page.insert_text((72, 760), str(k + 1), fontsize=9)
+    return doc.tobytes()
+
+def make_pptx():
+    """A minimal but valid .pptx: just the parts the slide-text extractor reads."""
+    p  = "http://schemas.openxmlformats.org/presentationml/2006/main"
+    a  = "http://schemas.openxmlformats.org/drawingml/2006/main"
+    r  = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    rl = "http://schemas.openxmlformats.org/package/2006/relationships"
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        ids, rels = [], []
+        for k, (title, points) in enumerate(LECTURE, start=1):
+            paras = "".join(f"<a:p><a:r><a:t>{t}</a:t></a:r></a:p>" for t in [title] + points)
+            zf.writestr(f"ppt/slides/slide{k}.xml",
+                        f'<p:sld xmlns:p="{p}" xmlns:a="{a}"><p:cSld><p:spTree><p:sp><p:txBody>'
+                        f'{paras}</p:txBody></p:sp></p:spTree></p:cSld></p:sld>')
+            ids.append(f'<p:sldId id="{255 + k}" r:id="rId{k}"/>')
+            rels.append(f'<Relationship Id="rId{k}" Target="slides/slide{k}.xml" '
+                        f'Type="{r}/slide"/>')
+        zf.writestr("ppt/presentation.xml",
+                    f'<p:presentation xmlns:p="{p}" xmlns:r="{r}"><p:sldIdLst>{"".join(ids)}'
+                    f'</p:sldIdLst></p:presentation>')
+        zf.writestr("ppt/_rels/presentation.xml.rels",
+                    f'<Relationships xmlns="{rl}">{"".join(rels)}</Relationships>')
+    return buf.getvalue()
+
+def make_image():
+    from PIL import Image, ImageDraw
+    img  = Image.new("RGB", (1600, 1200), "white")
+    draw = ImageDraw.Draw(img)
+    y    = 60
+    for title, points in LECTURE:
+        draw.text((60, y), title, fill="black")
+        for point in points:
+            y += 40
+            draw.text((90, y), "- " + point, fill="black")
+        y += 80
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+FIXTURES = {
+    "pdf":   ("lecture.pdf",  make_pdf),
+    "pptx":  ("lecture.pptx", make_pptx),
+    "image": ("slide.jpg",    make_image),
+}
+
+
+# ── HTTP ─────────────────────────────────────────────────────────────────────
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, value in fields.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                  f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        out.write(data)
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
+    return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.samples = {}    # name -> [seconds]
+        self.errors  = {}    # name -> count
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, name):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+# ── VIRTUAL USER ─────────────────────────────────────────────────────────────
+
+STAGES = {0: "extract", 1: "llm", 2: "render"}
+
+def watch_progress(opener, base, session_id, events, stop, stats):
+    """
+    Keep a /progress stream open for the whole session, reconnecting when
+    the server ends it, like the browser's EventSource; timestamp every event.
+    """
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            resp = opener.open(f"{base}/progress?session_id={session_id}", timeout=120)
+        except (urllib.error.URLError, OSError):
+            stats.error("/progress")
+            time.sleep(1)
+            continue
+        stats.add("/progress (connect)", time.perf_counter() - t0)
+        with resp:
+            while not stop.is_set():
+                line = resp.readline()
+                if not line:
+                    break
+                if line.startswith(b"data: "):
+                    events.append((time.perf_counter(), json.loads(line[6:])))
+
+def record_server_timing(stats, header):
+    """Add each `name;dur=ms` entry of a Server-Timing header as a "server: name" sample."""
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.startswith("dur="):
+            stats.add(f"server: {name}", float(params[4:]) / 1000)
+
+
+def virtual_user(base, kinds, deadline, stats, fixtures):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    session_id = json.load(opener.open(f"{base}/get_session", timeout=30))["session_id"]
+    events, stop = [], threading.Event()
+    threading.Thread(target=watch_progress, args=(opener, base, session_id, events, stop, stats),
+                     daemon=True).start()
+    time.sleep(0.1)   # let the stream attach, as the browser does on page load
+
+    k = 0
+    while time.perf_counter() < deadline:
+        kind = kinds[k % len(kinds)]
+        k   += 1
+        filename, data = fixtures[kind]
+
+        body, ctype = _multipart({"instructions": ""}, {"pdf": (filename, data)})
+        req = urllib.request.Request(f"{base}/generate", data=body, headers={"Content-Type": ctype})
+        t0  = time.perf_counter()
+        try:
+            resp  = opener.open(req, timeout=600)
+            pages = json.load(resp)["pages"]
+        except (urllib.error.URLError, OSError, KeyError, ValueError):
+            stats.error("/generate")
+            continue
+        t1 = time.perf_counter()
+        stats.add("/generate", t1 - t0)
+        stats.add(f"/generate [{kind}]", t1 - t0)
+        record_server_timing(stats, resp.headers.get("Server-Timing"))
+
+        # Per-stage breakdown from when each step was first announced during this request
+        first = {}
+        for ts, ev in list(events):
+            if t0 <= ts <= t1:
+                first.setdefault(ev.get("step"), ts)
+        marks = [(STAGES[s], first[s]) for s in sorted(first) if s in STAGES]
+        for (name, start), (_, end) in zip(marks, marks[1:] + [("done", t1)]):
+            stats.add(f"stage: {name}", end - start)
+
+        req = urllib.request.Request(f"{base}/download", data=json.dumps({"pages": pages}).encode(),
+                                     headers={"Content-Type": "application/json"})
+        t0 = time.perf_counter()
+        try:
+            resp = opener.open(req, timeout=300)
+            resp.read()
+            stats.add("/download", time.perf_counter() - t0)
+            record_server_timing(stats, resp.headers.get("Server-Timing"))
+        except (urllib.error.URLError, OSError):
+            stats.error("/download")
+    stop.set()
+
+
+# ── MAIN ─────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app against a local OpenAI mock")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--fixtures", default="pdf,pptx,image", help="comma list of pdf,pptx,image")
+    parser.add_argument("--profile", default="gpt-4o-mini", choices=sorted(mock_openai.FAKE_LLM_PROFILES))
+    parser.add_argument("--latency", type=float, help="mock seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, help="mock token rate, 0 = unlimited")
+    parser.add_argument("--cache", action="store_true", help="leave the extraction/notes caches on")
+    parser.add_argument("--json", help="also write the report here")
+    args = parser.parse_args()
+
+    kinds    = [k.strip() for k in args.fixtures.split(",") if k.strip()]
+    fixtures = {k: (FIXTURES[k][0], FIXTURES[k][1]()) for k in kinds}
+
+    mock = mock_openai.serve(0, args.latency, args.tokens_per_sec, args.profile)
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    tmp  = tempfile.mkdtemp(prefix="loadtest-")
+    env  = dict(os.environ,
+                PORT=str(port),
+                RAILWAY_ENVIRONMENT="loadtest",          # no debug reloader
+                LLM_BACKEND="openai",
+                OPENAI_API_KEY="loadtest",
+                OPENAI_BASE_URL=f"http://127.0.0.1:{mock.server_port}/v1",
+                CACHE_DIR=tmp,
+                WARM_UP=SERVER_WARM_UP)
+    if not args.cache:
+        env.update(NOTES_CACHE_PATH="", EXTRACT_CACHE_PATH="",
+                   NOTES_CACHE_ENTRIES="0", EXTRACT_CACHE_ITEMS="0")
+    log    = open(os.path.join(tmp, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "app.py")],
+                              cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    memory = []
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(base + "/ready", timeout=2).read()   # 503 until warm-up is done
+                break
+            except (urllib.error.URLError, OSError):
+                if server.poll() is not None:
+                    sys.exit(f"Server exited early; see {log.name}")
+                time.sleep(0.1)
+        else:
+            sys.exit(f"Server never became ready (/ready kept failing, e.g. a failed warm-up); see {log.name}")
+
+        stats    = Stats()
+        start    = time.perf_counter()
+        deadline = start + args.duration
+        done     = threading.Event()
+
+        def sample_memory():
+            while not done.wait(0.5):
+                memory.append((time.perf_counter() - start, _rss_kb(server.pid)))
+        threading.Thread(target=sample_memory, daemon=True).start()
+
+        users = [threading.Thread(target=virtual_user, args=(base, kinds[u % len(kinds):] + kinds[:u % len(kinds)],
+                                                             deadline, stats, fixtures))
+                 for u in range(args.users)]
+        for u in users:
+            u.start()
+        for u in users:
+            u.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        mock.shutdown()
+        log.close()
+
+    report = {"users": args.users, "elapsed_s": round(elapsed, 2), "endpoints": {}, "memory_kb": memory}
+    print(f"\n{args.users} users, {elapsed:.1f}s, mock profile {args.profile}\n")
+    print(f"{'':<26}{'n':>6}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name in sorted(set(stats.samples) | set(stats.errors)):
+        xs  = stats.samples.get(name, [])
+        row = {"n": len(xs), "errors": stats.errors.get(name, 0), "rps": len(xs) / elapsed,
+               "p50": percentile(xs, .5) * 1000, "p95": percentile(xs, .95) * 1000,
+               "p99": percentile(xs, .99) * 1000, "max": max(xs, default=float("nan")) * 1000}
+        report["endpoints"][name] = row
+        print(f"{name:<26}{row['n']:>6}{row['errors']:>5}{row['rps']:>8.2f}{row['p50']:>9.0f}"
+              f"{row['p95']:>9.0f}{row['p99']:>9.0f}{row['max']:>9.0f}")
+
+    rss = [kb for _, kb in memory if kb]
+    if rss:
+        print(f"\nServer RSS: start {rss[0] / 1024:.0f} MB, peak {max(rss) / 1024:.0f} MB, "
+              f"end {rss[-1] / 1024:.0f} MB")
+        step = max(1, len(memory) // 12)
+        print("  " + "  ".join(f"{t:.0f}s:{kb / 1024:.0f}MB" for t, kb in memory[::step] if kb))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Local OpenAI stand-in
+----------------------
+Run: python mock_openai.py --port 8099 --profile gpt-4o-mini
+Then start the app with OPENAI_BASE_URL=http://127.0.0.1:8099/v1
+
+Serves POST /v1/chat/completions (plain and stream=true) with replies
+from app.FakeBackend, paced by a latency / token-rate profile, so the
+real OpenAI client code path can be load-tested without network or spend.
+"""
+
+import argparse, json, os, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("WARM_UP", "0")   # only FakeBackend is needed, not the renderer
+from app import FakeBackend, FAKE_LLM_PROFILES
+
+
+def make_handler(backend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):   # keep load-test output readable
+            pass
+
+        def _json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                return self._json(404, {"error": {"message": f"No route {self.path}"}})
+            length = int(self.headers.get("Content-Length", 0))
+            req    = json.loads(self.rfile.read(length) or b"{}")
+            model  = req.get("model", "gpt-4o-mini")
+            base   = {"id": "chatcmpl-" + uuid.uuid4().hex[:24], "created": int(time.time()), "model": model}
+
+            if not req.get("stream"):
+                text = backend.complete(model, req["messages"], req.get("max_tokens"))
+                return self._json(200, {
+                    **base,
+                    "object":  "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": text}}],
+                    "usage":   {"prompt_tokens": 0, "completion_tokens": len(text) // 4,
+                                "total_tokens": len(text) // 4},
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def event(delta, finish=None):
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            try:
+                event({"role": "assistant", "content": ""})
+                for piece in backend.stream(model, req["messages"]):
+                    event({"content": piece})
+                event({}, "stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # client gave up mid-stream
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port=0, latency=None, tokens_per_sec=None, profile="gpt-4o-mini"):
+    """Start the mock in a background thread; returns the server (server.server_port has the port)."""
+    backend = FakeBackend.from_profile(profile)
+    if latency is not None:
+        backend.latency = latency
+    if tokens_per_sec is not None:
+        backend.tokens_per_sec = tokens_per_sec or None
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(backend))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--profile", default="gpt-4o-mini", choices=sorted(FAKE_LLM_PROFILES))
+    parser.add_argument("--latency", type=float, help="seconds to first token (overrides profile)")
+    parser.add_argument("--tokens-per-sec", type=float, help="0 = unlimited (overrides profile)")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.tokens_per_sec, args.profile)
+    print(f"Mock OpenAI at http://127.0.0.1:{server.server_port}/v1 (profile {args.profile})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
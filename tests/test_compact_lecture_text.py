@@ -0,0 +1,29 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WARM_UP", "0")
+
+from app import compact_lecture_text
+
+
+def test_numeric_table_cells_are_kept():
+    raw = "[Slide 1]\nResults\nYear\nCount\n2019\n12\n2020\n15"
+    text, _ = compact_lecture_text(raw)
+    assert text == raw
+
+
+def test_numbered_lines_inside_pages_are_not_boilerplate():
+    pages = [f"CS 101 - Lecture 4 - {k}\nExample {k}\nThe gradient drives transport across membrane {k}\n{k}"
+             for k in range(1, 7)]
+    text, _ = compact_lecture_text("\n\n".join(pages))
+    for k in range(1, 7):
+        assert f"Example {k}" in text
+        assert f"across membrane {k}" in text
+    assert "CS 101" not in text                       # repeated header
+    assert not any(line.isdigit() for line in text.split("\n"))   # page numbers
+
+
+def test_slide_titles_with_an_index_are_kept():
+    slides = [f"[Slide {k}]\nExample {k}\nWork through case {k} by hand" for k in range(1, 8)]
+    text, _ = compact_lecture_text("\n\n".join(slides))
+    assert all(f"Example {k}" in text for k in range(1, 8))
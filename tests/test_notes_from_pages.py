@@ -0,0 +1,56 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WARM_UP", "0")
+
+import pytest
+import app
+
+
+class CountingBackend(app.FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def complete(self, model, messages, max_tokens=None):
+        self.calls += 1
+        return super().complete(model, messages, max_tokens)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = CountingBackend()
+    monkeypatch.setattr(app, "_llm_backend", backend)
+    monkeypatch.setattr(app, "extract_cache", app.TieredCache("extract"))
+    monkeypatch.setattr(app, "notes_cache", app.TieredCache("notes"))
+    monkeypatch.setattr(app, "PDF_PARALLEL_MIN_PAGES", 6)
+    monkeypatch.setattr(app, "NOTES_CHUNK_TOKENS", 120)
+    return backend
+
+
+def make_pdf(pages=12):
+    doc = app.lazy_import("fitz").open()
+    for i in range(pages):
+        page = doc.new_page()
+        for k in range(6):
+            page.insert_text((40, 60 + 24 * k), f"Topic {i} point {k}: osmotic pressure drives water flux", fontsize=10)
+    return doc.tobytes()
+
+
+def generate(pdf):
+    extracted = app.extract_from_upload(pdf, "lecture.pdf", stream_pages=True)
+    if isinstance(extracted, str):
+        return list(app.iter_notes_lines(extracted))
+    return list(app.iter_notes_lines_from_pages(extracted))
+
+
+@pytest.mark.parametrize("budget", [300, 64000])
+def test_streamed_pdf_fills_both_caches(backend, monkeypatch, budget):
+    monkeypatch.setattr(app, "NOTES_TOKEN_BUDGET", budget)
+    pdf   = make_pdf()
+    first = generate(pdf)
+    calls = backend.calls
+    assert calls > 1 and first
+
+    assert generate(pdf) == first
+    assert backend.calls == calls   # extract and notes cache hits: no LLM calls the second time